@@ -0,0 +1,184 @@
+#  © 2018 Matt Fan
+# http://mattfan.me/
+
+from itertools import product
+from cardobjects import Card, Hand, ALL_CARDS, popcount
+from eleusisobjects import Line, Rule
+
+# Measures how hard a rule is by evaluating it over every state it can depend on: every possible
+# last `depth` cards of the MAIN LINE, against every one of the 52 candidate cards.
+#
+# The result is a truth table packed into a single int. Each state gets a 64-bit row (STRIDE),
+# with bit n of the row set if the card with code n passes in that state. Pass counts, dead ends
+# and the difference between two rules then come down to a handful of whole-table int operations
+# instead of a Python loop over every state.
+#
+# Tables are built from the rule's compiled accept masks (see Rule.compile). A rule with a window
+# of w only has 52**w distinct rows, and a deeper table is those rows repeated, since a state's
+# index ends in its last w cards, so it's one bytes multiplication. A merge or overlay of compiled
+# rules is its parts' tables ANDed or ORed together. For rules with a window of 0 or 1, and
+# composites of them, analysis takes milliseconds at any depth up to 3.
+#
+# What can't be shortcut is a rule written as a single function of the last 2 or more cards: its
+# rows are only known by calling it, 52**(w + 1) times. That's about 0.05s for a window of 2 and
+# about 2.5s for a window of 3 (rules.py's three-in-a-row rule), whatever the depth. Rows that have
+# come up in play are taken from the rule's table instead. Rules whose window can't be worked out
+# at all are run against every state.
+
+STRIDE = 64
+_ROW_BYTES = STRIDE // 8
+_fieldMasks = {} # number of states -> (ALL_CARDS in every row, bit 52 of every row)
+
+
+def packRows(rows):
+    # Packs a list of 52-bit rows into one table, row 0 in the lowest bits
+    return int.from_bytes(b''.join(row.to_bytes(_ROW_BYTES, 'little') for row in rows), 'little')
+
+
+def unpackRows(table, states):
+    data = table.to_bytes(states * _ROW_BYTES, 'little')
+    return [int.from_bytes(data[i:i + _ROW_BYTES], 'little') for i in range(0, len(data), _ROW_BYTES)]
+
+
+def fieldMasks(states):
+    if states not in _fieldMasks:
+        _fieldMasks[states] = (
+            int.from_bytes(ALL_CARDS.to_bytes(_ROW_BYTES, 'little') * states, 'little'),
+            int.from_bytes((1 << 52).to_bytes(_ROW_BYTES, 'little') * states, 'little'),
+        )
+    return _fieldMasks[states]
+
+
+def deadEndCount(table, states):
+    # Counts the rows with no passing card, all at once: adding 2^52 - 1 to a row carries into
+    # bit 52 exactly when the row isn't empty, and rows are wide enough that nothing spills over.
+    fill, carry = fieldMasks(states)
+    return states - popcount((table + fill) & carry)
+
+
+def passProbability(table, states):
+    return popcount(table) / (52 * states)
+
+
+def repeatTable(table, states, times):
+    # A table of `states` rows laid end to end `times` times
+    return int.from_bytes(table.to_bytes(states * _ROW_BYTES, 'little') * times, 'little')
+
+
+class RuleAnalysis:
+    def __init__(self, rule, depth, table):
+        self.rule = rule
+        self.depth = depth
+        self.states = 52 ** depth
+        self.table = table
+        self.unpacked = None
+
+    @property
+    def rows(self):
+        # One accept mask per state, unpacked from the table the first time they're asked for
+        if self.unpacked is None:
+            self.unpacked = unpackRows(self.table, self.states)
+        return self.unpacked
+
+    def rowAt(self, index):
+        return self.table >> (index * STRIDE) & ALL_CARDS
+
+    def stateAt(self, index):
+        # The MAIN LINE suffix for a state index, oldest card first
+        codes = []
+        for n in range(self.depth):
+            index, code = divmod(index, 52)
+            codes.append(Card.fromCode(code))
+        return list(reversed(codes))
+
+    def indexOf(self, cards):
+        index = 0
+        for card in cards[-self.depth:]:
+            index = index * 52 + card.code
+        return index
+
+    def passProbability(self):
+        # Chance that a random candidate passes in a random state
+        return passProbability(self.table, self.states)
+
+    def deadEndRate(self):
+        # Fraction of states in which no card at all passes
+        return deadEndCount(self.table, self.states) / self.states
+
+    def deadEnds(self):
+        return [self.stateAt(i) for i, row in enumerate(self.rows) if not row]
+
+    def stateOdds(self, cards):
+        # Chance that a random card passes after the given MAIN LINE suffix
+        return popcount(self.rowAt(self.indexOf(cards))) / 52
+
+    def hardestStates(self, n = 5):
+        ranked = sorted(range(self.states), key=lambda i: popcount(self.rows[i]))
+        return [(self.stateAt(i), popcount(self.rows[i]) / 52) for i in ranked[:n]]
+
+    def difference(self, other):
+        # Fraction of (state, candidate) pairs on which the two rules disagree
+        if self.depth != other.depth:
+            raise ValueError('Rules must be analyzed at the same depth to be compared')
+        return popcount(self.table ^ other.table) / (52 * self.states)
+
+    def summary(self):
+        return {
+            'rule': self.rule.name,
+            'depth': self.depth,
+            'passProbability': self.passProbability(),
+            'deadEndRate': self.deadEndRate(),
+        }
+
+
+def stateLine(state):
+    line = Line()
+    for card in state:
+        line.addToMain(card)
+    return line
+
+
+def windowTable(rule):
+    # Table of a compiled rule over every suffix as long as its window (at least one card)
+    if rule.window < 2:
+        return packRows(rule.table if rule.window else rule.table * 52), 1
+    rows = []
+    for state in product(Card.allCards(), repeat=rule.window):
+        row = rule.table.get(tuple(card.code for card in state))
+        if row is None: # not come up in play yet; worked out here without filling the rule's table
+            line = stateLine(state)
+            row = rule.buildRow(line.getMainLine(), line.getFullLine(), None)
+        rows.append(row)
+    return packRows(rows), rule.window
+
+
+def tabulate(rule, depth):
+    # Table of any rule, by running it against every `depth`-card suffix. 52**(depth + 1) calls.
+    hand = Hand()
+    rows = []
+    for state in product(Card.allCards(), repeat=depth):
+        line = stateLine(state)
+        try:
+            rows.append(rule.row(line.getMainLine(), line.getFullLine(), hand))
+        except IndexError:
+            raise ValueError(f"'{rule.name}' looks further back than {depth} card(s); analyze it with a larger depth")
+    return packRows(rows)
+
+
+def analyze(rule, depth = 1):
+    # The rule's verdict for every candidate after every possible `depth`-card MAIN LINE suffix
+    if depth < 1:
+        raise ValueError('depth must be at least 1')
+    compiled = rule
+    if rule.table is None:
+        window = rule.detectWindow()
+        compiled = Rule(rule.name, rule.f, window) if window is not None else None
+    if compiled is None:
+        return RuleAnalysis(rule, depth, tabulate(rule, depth))
+    if compiled.window > depth:
+        raise ValueError(f"'{rule.name}' looks further back than {depth} card(s); analyze it with a larger depth")
+    if compiled.parts is not None:
+        left, right, op = compiled.parts
+        return RuleAnalysis(rule, depth, op(analyze(left, depth).table, analyze(right, depth).table))
+    table, window = windowTable(compiled)
+    return RuleAnalysis(rule, depth, repeatTable(table, 52 ** window, 52 ** (depth - window)))
@@ -0,0 +1,162 @@
+#  © 2018 Matt Fan
+# http://mattfan.me/
+
+import json
+import platform
+import sys
+from argparse import ArgumentParser
+from random import Random
+from timeit import Timer
+from cardobjects import Card, Suit, Hand, Deck
+from eleusisobjects import Line, Context
+from engine import Engine, OracleAgent, RandomAgent
+from rules import rules as myRules
+from analysis import analyze
+
+# Benchmarks for the hot paths: card comparisons, line views, rule tests, hand odds, dealing,
+# whole automated rounds for every rule, and rule analysis. Results are written as JSON so runs from
+# different versions can be compared:
+#   python benchmarks.py --output before.json
+#   ... change things ...
+#   python benchmarks.py --output after.json --compare before.json
+# Every benchmark reports the best time per operation over several repeats, in nanoseconds.
+
+LINE_SIZES = [10, 100, 1000, 10000]
+DECK_COUNTS = [1, 5, 20]
+
+
+def timePerOp(statement, number, repeat):
+    # Best of `repeat` runs of `number` calls, in nanoseconds per call
+    return min(Timer(statement).repeat(repeat, number)) / number * 1e9
+
+
+def randomLine(size, rng):
+    deck = Deck(size // 52 + 1, rng)
+    line = Line()
+    line.addToMain(deck.deal())
+    for n in range(size - 1):
+        if rng.random() < .7:
+            line.addToMain(deck.deal())
+        else:
+            line.addToSide(deck.deal())
+    return line
+
+
+def cardBenchmarks(repeat):
+    ace, king = Card('A', Suit.HEART), Card('K', Suit.SPADE)
+    yield 'card.compare', {}, timePerOp(lambda: (ace < king, ace >= king, king > ace), 100000, repeat) / 3
+    yield 'card.valAsNum', {}, timePerOp(king.valAsNum, 100000, repeat)
+    yield 'card.parse', {}, timePerOp(lambda: Card.parse('Queen of Diamonds'), 20000, repeat)
+
+
+def lineBenchmarks(repeat, rng):
+    for size in LINE_SIZES:
+        line = randomLine(size, rng)
+        yield 'line.getMainLine', {'line': size}, timePerOp(line.getMainLine, 100000, repeat)
+        yield 'line.getFullLine', {'line': size}, timePerOp(line.getFullLine, 100000, repeat)
+        card = Card(7, Suit.HEART)
+        yield 'line.addToMain', {'line': size}, timePerOp(lambda: line.addToMain(card), 10000, 1)
+
+
+def ruleBenchmarks(repeat, rng):
+    candidates = Card.allCards()
+    for size in LINE_SIZES:
+        context = Context(randomLine(size, rng), Hand(candidates[:12]))
+        for index, rule in enumerate(myRules):
+            yield 'rule.test', {'line': size, 'rule': index}, timePerOp(
+                lambda: [rule.test(card, context) for card in candidates], 200, repeat) / 52
+            yield 'rule.testMany', {'line': size, 'rule': index}, timePerOp(
+                lambda: rule.testMany(candidates, context), 200, repeat) / 52
+        hand = context.hand
+        yield 'hand.odds', {'line': size, 'hand': len(hand)}, timePerOp(lambda: hand.odds(myRules[0], context), 20000, repeat)
+        yield 'hand.removeAPassingCard', {'line': size}, timePerOp(
+            lambda: hand.addCard(hand.removeAPassingCard(myRules[0], context) or candidates[0]), 20000, repeat)
+
+
+def deckBenchmarks(repeat, rng):
+    for decks in DECK_COUNTS:
+        yield 'deck.new', {'decks': decks}, timePerOp(lambda: Deck(decks, rng), 2000, repeat)
+        deck = Deck(decks, rng)
+        yield 'deck.deal', {'decks': decks}, timePerOp(deck.deal, 50000, repeat)
+
+
+def roundBenchmarks(repeat, rounds, seed):
+    names = ['a', 'b', 'c', 'd']
+    for index, rule in enumerate(myRules):
+        for kind in ('oracle', 'random'):
+            rng = Random(seed)
+            engine = Engine(names, {}, rng)
+            agents = { name: OracleAgent() if kind == 'oracle' else RandomAgent(rng.choice) for name in names }
+            yield 'round', {'rule': index, 'agent': kind}, timePerOp(lambda: engine.playRound(rule, agents, 2000), rounds, repeat)
+
+
+def analysisBenchmarks(repeat):
+    # analyze() for every rule at every depth from its window up to 3. The single-function rule
+    # with a window of 3 is timed too, at its real cost of a few seconds (see analysis.py).
+    for index, rule in enumerate(myRules):
+        for depth in range(max(rule.window or 1, 1), 4):
+            slow = rule.window is not None and rule.window >= 2 and rule.parts is None
+            yield 'analyze', {'rule': index, 'depth': depth}, timePerOp(lambda: analyze(rule, depth), 1, 1 if slow else repeat)
+
+
+def runBenchmarks(repeat = 3, rounds = 20, seed = 0, only = None):
+    # Returns a list of {'name', 'params', 'ns'} results
+    rng = Random(seed)
+    groups = {
+        'card': lambda: cardBenchmarks(repeat),
+        'line': lambda: lineBenchmarks(repeat, rng),
+        'rule': lambda: ruleBenchmarks(repeat, rng),
+        'deck': lambda: deckBenchmarks(repeat, rng),
+        'round': lambda: roundBenchmarks(repeat, rounds, seed),
+        'analysis': lambda: analysisBenchmarks(repeat),
+    }
+    results = []
+    for group, benchmarks in groups.items():
+        if only and group not in only:
+            continue
+        for name, params, ns in benchmarks():
+            results.append({'name': name, 'params': params, 'ns': ns})
+    return results
+
+
+def key(result):
+    return result['name'] + json.dumps(result['params'], sort_keys=True)
+
+
+def compare(old, new, threshold = .1):
+    # Pairs up results by name and parameters. Returns (result, old ns, ratio) for every benchmark
+    # that got slower than `threshold` (0.1 = 10% slower).
+    before = { key(result): result['ns'] for result in old }
+    regressions = []
+    for result in new:
+        if key(result) in before:
+            ratio = result['ns'] / before[key(result)]
+            if ratio > 1 + threshold:
+                regressions.append((result, before[key(result)], ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description='Benchmark cards, lines, rules, decks and automated rounds.')
+    parser.add_argument('--output', help='write results to this JSON file (default: stdout)')
+    parser.add_argument('--compare', help='JSON results from an earlier run to check for regressions')
+    parser.add_argument('--threshold', type=float, default=.1, help='slowdown that counts as a regression')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--rounds', type=int, default=20, help='rounds per round benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', action='append', choices=['card', 'line', 'rule', 'deck', 'round', 'analysis'])
+    args = parser.parse_args()
+    results = runBenchmarks(args.repeat, args.rounds, args.seed, args.only)
+    report = {'python': platform.python_version(), 'platform': platform.platform(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(json.load(file)['results'], results, args.threshold)
+        for result, before, ratio in regressions:
+            print(f"REGRESSION {result['name']} {result['params']}: {before:.0f}ns -> {result['ns']:.0f}ns ({ratio:.2f}x)", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
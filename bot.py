@@ -0,0 +1,122 @@
+#  © 2018 Matt Fan
+# http://mattfan.me/
+
+from cardobjects import Card, codesIn, popcount
+from analysis import STRIDE
+from engine import Agent, NO_PLAY
+from generator import RuleGenerator
+from rules import rules as myRules
+
+# A player that works out the rule as it goes. It starts from a space of hypotheses (the rules
+# in rules.py and composites of them from generator.py) and drops every hypothesis that disagrees
+# with a card as it lands on the MAIN LINE or SIDE LINE.
+#
+# Which hypotheses are still alive is a bitset with one bit per hypothesis. For every (last MAIN
+# LINE card, card played) pair, the space keeps the bitset of hypotheses that accept it, so taking
+# in a card is a single AND, and the chance a card in hand passes is one AND and a popcount,
+# however many hypotheses there are.
+
+_ROW_BYTES = STRIDE // 8
+# _bitChars[n] translates each byte to b'1' or b'0' by bit n
+_bitChars = [bytes(48 + (byte >> bit & 1) for byte in range(256)) for bit in range(8)]
+
+
+def transpose(tables, chunk = 1024):
+    # Turns depth-1 truth tables (one per hypothesis) into one bitset per (last card, candidate)
+    # pair, with bit i set if hypothesis i accepts the candidate after that last card.
+    # The tables of a chunk are laid end to end as bytes, so a pair's byte in every table is one
+    # strided slice, and translate() and int(s, 2) pick its bit out of all of them at once.
+    columns = [0] * (52 * 52)
+    width = 52 * _ROW_BYTES
+    for start in range(0, len(tables), chunk):
+        matrix = b''.join(table.to_bytes(width, 'little') for table in tables[start:start + chunk])
+        for last in range(52):
+            for code in range(52):
+                bits = matrix[last * _ROW_BYTES + code // 8::width].translate(_bitChars[code % 8])
+                columns[last * 52 + code] |= int(bits[::-1], 2) << start
+    return columns
+
+
+class HypothesisSpace:
+    # Candidate rules and their transposed truth tables. Building one takes a moment, but it can
+    # be shared by any number of bots.
+    def __init__(self, candidates):
+        self.candidates = candidates # generator.Candidates
+        self.size = len(candidates)
+        self.everything = (1 << self.size) - 1
+        self.columns = transpose([candidate.table for candidate in candidates])
+
+    @classmethod
+    def fromRules(cls, rules = myRules, maxLeaves = 3):
+        # The rules (with a window of 0 or 1) and every distinct composite of up to maxLeaves of them
+        return cls(list(RuleGenerator(rules).candidates(maxLeaves)))
+
+    def accepting(self, last, card):
+        # Bitset of hypotheses under which card passes after last
+        return self.columns[last.code * 52 + card.code]
+
+
+class Inference:
+    # What one player has worked out about the rule from a Line
+    def __init__(self, space):
+        self.space = space
+        self.reset(None)
+
+    def reset(self, line):
+        self.line = line
+        self.alive = self.space.everything
+        self.row = 0 # rows of the line taken in so far; the last one may gain side cards
+        self.side = 0 # side cards of row self.row - 1 taken in so far
+
+    def passed(self, last, card):
+        self.alive &= self.space.accepting(last, card)
+
+    def failed(self, last, card):
+        self.alive &= ~self.space.accepting(last, card)
+
+    def observe(self, line):
+        # Takes in every card added to the line since the last call (or the whole line if it's new)
+        if line is not self.line:
+            self.reset(line)
+        # Rows already taken in are only checked for new side cards. The first row has no card
+        # before it to pass, but its side cards still failed after its main card.
+        start = max(self.row - 1, 0)
+        previous = None
+        for i, (main, side) in enumerate(line.rows(start), start):
+            if i < self.row:
+                side = side[self.side:]
+            elif previous is not None:
+                self.passed(previous, main)
+            for card in side:
+                self.failed(main, card)
+            self.side = len(side) if i >= self.row else self.side + len(side)
+            self.row = i + 1
+            previous = main
+
+    def survivors(self):
+        return [self.space.candidates[i] for i in codesIn(self.alive)]
+
+    def chooseMove(self, hand, last):
+        # The card in hand most likely to pass after last, or NO_PLAY if it's likelier that none do
+        alive = self.alive
+        if not alive:
+            return next(iter(hand)) # the rule isn't in the space; nothing left to go on
+        best, bestCount, anyPass = None, -1, 0
+        for code in codesIn(hand.mask):
+            accepting = alive & self.space.columns[last.code * 52 + code]
+            anyPass |= accepting
+            count = popcount(accepting)
+            if count > bestCount:
+                best, bestCount = code, count
+        if popcount(alive) - popcount(anyPass) > bestCount:
+            return NO_PLAY
+        return Card.fromCode(best)
+
+
+class InferenceAgent(Agent):
+    def __init__(self, space):
+        self.inference = Inference(space)
+
+    def chooseMove(self, engine, player):
+        self.inference.observe(engine.line)
+        return self.inference.chooseMove(player.hand, engine.line.getMainLine()[-1])
@@ -3,12 +3,30 @@
 
 # Fun Fact: One of my first jobs was as a marriage counselling intern for the Navy
 
-from random import shuffle, choice as randomChoice
+from random import Random, random, shuffle, choice as randomChoice
 from enum import Enum
+import re
 
 # I wrote some classes to help with the representation of objects for this game.
 # Many of these can be reused in implementations of other card games.
 
+# Sets of cards are often packed into an int, with bit n set for the card with code n.
+try:
+    popcount = int.bit_count
+except AttributeError: # before Python 3.10
+    def popcount(x):
+        return bin(x).count('1')
+
+ALL_CARDS = (1 << 52) - 1
+
+def codesIn(mask):
+    # Codes of the bits set in a mask, lowest first
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
 class Color(Enum):
     RED = 0
     BLACK = 1
@@ -27,6 +45,10 @@ class Suit(Enum):
 
 
 class Card:
+    # Cards are flyweights: there are exactly 52 of them, built once below and shared by every
+    # Deck, Hand and Line. Card(value, suit) hands back the shared instance rather than a new one.
+    __slots__ = ('value', 'suit', 'code', 'rank', 'highRank', 'color')
+
     valueNames = {
         'A': 'Ace',
         2: 'Two',
@@ -57,23 +79,87 @@ class Card:
         Suit.DIAMOND: 'Diamonds'
     }
 
-    def __init__(self, value, suit):
-        self.suit = suit
-        self.value = value
+    suitLetters = {
+        Suit.CLUB: 'C',
+        Suit.HEART: 'H',
+        Suit.SPADE: 'S',
+        Suit.DIAMOND: 'D'
+    }
+
+    # Outlined symbols, which parse() accepts as well
+    altSuitSymbols = {
+        Suit.CLUB: '♧',
+        Suit.HEART: '♡',
+        Suit.SPADE: '♤',
+        Suit.DIAMOND: '♢'
+    }
+
+    # Numeric rank of each value with ace low. Ace high is the same, except ace is 14.
+    ranks = { 'A': 1, 2: 2, 3: 3, 4: 4, 5: 5, 6: 6, 7: 7, 8: 8, 9: 9, 10: 10, 'J': 11, 'Q': 12, 'K': 13 }
+
+    _cards = () # all 52 cards, indexed by code. Filled in below the class.
+    _lookup = {} # (value, suit) -> card, also accepting '2'..'10' as values
+    _parseTable = {} # every spelling parse() accepts, lowercased with whitespace removed -> card
+    _tokenPattern = None # splits a string of cards into tokens for parseMany()
+
+    def __new__(cls, value, suit):
+        try:
+            return cls._lookup[value, suit]
+        except (KeyError, TypeError):
+            raise ValueError(f"{value!r} of {suit!r} is not a card")
+
+    @classmethod
+    def _make(cls, value, suit):
+        # Only used to build the table of 52 cards
+        card = object.__new__(cls)
+        rank = cls.ranks[value]
+        object.__setattr__(card, 'value', value)
+        object.__setattr__(card, 'suit', suit)
+        object.__setattr__(card, 'code', (suit.value - 1) * 13 + rank - 1) # 0-51, grouped by suit
+        object.__setattr__(card, 'rank', rank)
+        object.__setattr__(card, 'highRank', 14 if rank == 1 else rank)
+        object.__setattr__(card, 'color', suit.color())
+        return card
+
+    @classmethod
+    def fromCode(cls, code):
+        return cls._cards[code]
+
+    @classmethod
+    def allCards(cls):
+        # One of each card, in code order
+        return cls._cards
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Cards are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Cards are immutable')
+
+    def __reduce__(self):
+        # Unpickles to the shared instance
+        return (Card.fromCode, (self.code,))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __hash__(self):
+        return self.code
+
+    def __repr__(self):
+        return f"Card({self.value!r}, {self.suit})"
     
-    def passesRule(self,rule):
-        #Pass in the value and suit.
-        #Returns True if the rule is passed, false otherwise
-        #takes a function which takes v (a value between 1 and 14), and s(a suit)
-        return rule.test(self) #
+    def passesRule(self, rule, context = None):
+        # Returns True if the card passes the rule against the given Context (line and hand)
+        return rule.test(self, context)
     
     @classmethod
-    def odds(cls, cards, rule):
-        # Brute force to figure out odds that a rule will pass for the given cards.
-        passes = 0
-        for card in cards:
-            if card.passesRule(rule): passes += 1
-        return passes / len(cards)
+    def odds(cls, cards, rule, context = None):
+        # Odds that a rule will pass for the given cards, tested as one batch
+        return sum(rule.testMany(cards, context)) / len(cards)
 
     def format(self):
         # String formatting
@@ -82,152 +168,242 @@ class Card:
         return '('+str(self.value)+self.suitSymbols[self.suit]+')'
     def fancyFormat(self):
         return f"{self.shortFormat():5}  {self.format()}"
+    def compactFormat(self):
+        return str(self.value) + self.suitLetters[self.suit]
 
     @classmethod
     def parse(cls, string):
-        # Opposite of 'format'
-        # Parses a string and returns a new card with the corresponding value if valid.
-        valueMap = dict([v.lower(),k] for k, v in cls.valueNames.items())
-        suitMap = dict([v.lower(),k] for k, v in cls.suitNames.items())
-        args = string.split()
-        if len(args) == 3 and args[0].lower() in valueMap and args[2].lower() in suitMap:
-            return cls(valueMap[args[0].lower()], suitMap[args[2].lower()])
-        # @TODO: raise error if no match found
+        # Opposite of 'format'. Accepts the long form ("Ace of Hearts"), the short form ("(A♥)" or "A♥")
+        # and compact codes ("AH", "10C", "TC"), ignoring case and whitespace.
+        # Returns the card, or raises CardParseError.
+        try:
+            card = cls._parseTable.get(''.join(string.lower().split()))
+        except AttributeError:
+            raise CardParseError(string, 0, 'expected a string')
+        if card is None:
+            raise CardParseError(string, 0, 'not a card')
+        return card
+
+    @classmethod
+    def parseMany(cls, cards):
+        # Parses a whole hand or logged line in one pass. Takes a list of strings (one card each), or
+        # one string of cards in any of the formats parse() accepts, separated by whitespace, commas,
+        # semicolons or '|'. CardParseError.position is the list index or the offset into the string.
+        if not isinstance(cards, str):
+            parsed = []
+            for i, string in enumerate(cards):
+                try:
+                    parsed.append(cls.parse(string))
+                except CardParseError as error:
+                    raise CardParseError(string, i, error.reason)
+            return parsed
+        parsed = []
+        position = 0
+        while position < len(cards):
+            match = cls._tokenPattern.match(cards, position)
+            if match.lastgroup == 'card':
+                parsed.append(cls._parseTable[''.join(match.group().lower().split())])
+            elif match.lastgroup == 'bad':
+                raise CardParseError(cards, position, f"'{match.group()}' is not a card")
+            position = match.end()
+        return parsed
     
 
     def __eq__(self, other):
         # Equality method
-        return self.value == other.value and self.suit == other.suit
+        if not isinstance(other, Card):
+            return NotImplemented
+        return self.code == other.code
     
     def __ne__(self,other):
-        return not self.__eq__(other)
-
-    def __mapToValue(self, map):
-        if self.value in map.keys():
-            return map[self.value]
-        return self.value
+        if not isinstance(other, Card):
+            return NotImplemented
+        return self.code != other.code
 
     def valAsNum(self):
-        return self.__mapToValue({ 'A':1, 'J':11, 'Q':12, 'K':13 })
+        return self.rank
 
+    # Comparisons treat the ace as high or low, whichever makes the comparison true,
+    # but two aces are always equal.
     def __lt__(self,other):
-        f1 = {'A':1,'J':11,'Q':12,'K':13}
-        f2 = {'A':14,'J':11,'Q':12,'K':13}
-        if self.value == 'A' and other.value == 'A':
+        if self.rank == 1 and other.rank == 1:
             return False
-        return self.__mapToValue(f1) < other.__mapToValue(f2)
+        return self.rank < other.highRank
 
     def __gt__(self,other):
-        f1 = {'A':14,'J':11,'Q':12,'K':13}
-        f2 = {'A':1,'J':11,'Q':12,'K':13}
-        if self.value == 'A' and other.value == 'A':
+        if self.rank == 1 and other.rank == 1:
             return False
-        return self.__mapToValue(f1) > other.__mapToValue(f2)
+        return self.highRank > other.rank
     
     def __ge__(self,other):
-        f1 = {'A':14,'J':11,'Q':12,'K':13}
-        f2 = {'A':1,'J':11,'Q':12,'K':13}
-        if self.value == 'A' and other.value == 'A':
+        if self.rank == 1 and other.rank == 1:
             return True
-        return self.__mapToValue(f1) >= other.__mapToValue(f2)
+        return self.highRank >= other.rank
     
     def __le__(self,other):
-        f1 = {'A':1,'J':11,'Q':12,'K':13}
-        f2 = {'A':14,'J':11,'Q':12,'K':13}
-        if self.value == 'A' and other.value == 'A':
+        if self.rank == 1 and other.rank == 1:
             return True
-        return self.__mapToValue(f1) <= other.__mapToValue(f2)
+        return self.rank <= other.highRank
+
+Card._cards = tuple(sorted(
+    (Card._make(v, s) for s in Suit for v in Card.valueNames),
+    key=lambda card: card.code
+))
+for card in Card._cards:
+    Card._lookup[card.value, card.suit] = card
+    if isinstance(card.value, int):
+        Card._lookup[str(card.value), card.suit] = card
+    values = [str(card.value).lower()] + (['t'] if card.value == 10 else [])
+    for value in values + [Card.valueNames[card.value].lower()]:
+        Card._parseTable[value + 'of' + Card.suitNames[card.suit].lower()] = card
+    for value in values:
+        for symbol in (Card.suitSymbols[card.suit], Card.altSuitSymbols[card.suit]):
+            Card._parseTable[value + symbol] = card
+            Card._parseTable['(' + value + symbol + ')'] = card
+        Card._parseTable[value + Card.suitLetters[card.suit].lower()] = card
+del card, values, value, symbol
+
+_value = r"(?:10|[2-9atjqk])"
+_suitSymbol = '[' + ''.join(Card.suitSymbols.values()) + ''.join(Card.altSuitSymbols.values()) + ']'
+Card._tokenPattern = re.compile(
+    r"(?P<sep>[\s,;|]+)"
+    r"|(?P<card>"
+        r"(?:ace|two|three|four|five|six|seven|eight|nine|ten|jack|queen|king|" + _value + r")\s+of\s+(?:clubs|hearts|spades|diamonds)\b"
+        r"|\(\s*" + _value + r"\s*" + _suitSymbol + r"\s*\)"
+        r"|" + _value + r"\s*" + _suitSymbol +
+        r"|" + _value + r"[chsd]\b"
+    r")"
+    r"|(?P<bad>[^\s,;|]+)",
+    re.IGNORECASE
+)
+del _value, _suitSymbol
+
+
+class CardParseError(ValueError):
+    # Raised by Card.parse and Card.parseMany. text is the input, position is where parsing failed
+    # (an index into the list, or an offset into the string), and reason says what went wrong.
+    def __init__(self, text, position, reason):
+        super().__init__(f"{reason} (at {position} in {text!r})")
+        self.text = text
+        self.position = position
+        self.reason = reason
 
 
 class Hand:
-    # Basic Hand Object
+    # Hand of cards, kept as a count per card code (multi-deck games can deal duplicates) plus a mask
+    # with bit n set while the hand holds at least one card with code n. Membership, adding and
+    # removing are O(1), and asking which cards pass a rule is one AND with the rule's accept mask.
     def __init__(self, cards = None):
-        self.hand = cards if cards else []
+        self.counts = [0] * 52
+        self.mask = 0
+        self.size = 0
+        for card in cards if cards else []:
+            self.addCard(card)
     
     def addCard(self, card):
-        self.hand.append(card)
+        self.counts[card.code] += 1
+        self.mask |= 1 << card.code
+        self.size += 1
     
     def hasCard(self, card):
-        for c in self.hand:
-            if c == card: return True
-        return False
+        return self.counts[card.code] > 0
+
+    def count(self, card):
+        return self.counts[card.code]
 
     def __len__(self):
-        return len(self.hand)
+        return self.size
     
     def __iter__(self):
-        self.index = 0
-        return self
+        # Cards in code order (grouped by suit), duplicates repeated
+        for code in codesIn(self.mask):
+            card = Card.fromCode(code)
+            for n in range(self.counts[code]):
+                yield card
 
-    def __next__(self):
-        try:
-            card = self.hand[self.index]
-            self.index += 1
-            return card
-        except IndexError:
-            raise StopIteration
-
-    def removeAPassingCard(self, rule):
-        index = -1
-        for i, card in enumerate(self.hand):
-            if card.passesRule(rule):
-                index = i
-                break
-        if index != -1:
-            return self.hand.pop(index) 
+    def passingMask(self, rule, context = None):
+        # Mask of the codes in this hand that pass the rule
+        return rule.acceptMask(context, self.mask)
+
+    def hasPassingCard(self, rule, context = None):
+        return self.passingMask(rule, context) != 0
+
+    def removeAPassingCard(self, rule, context = None):
+        passing = self.passingMask(rule, context)
+        if passing:
+            return self.removeCard(Card.fromCode((passing & -passing).bit_length() - 1))
         return None
 
-    def odds(self, rule):
-        # Brute force to figure out odds that a rule will pass for the given cards.
+    def odds(self, rule, context = None):
+        # Fraction of the cards in the hand (counting duplicates) that pass the rule
         passes = 0
-        for card in self.hand:
-            if card.passesRule(rule): passes += 1
-        return passes / len(self.hand)
+        for code in codesIn(self.passingMask(rule, context)):
+            passes += self.counts[code]
+        return passes / self.size
 
     def removeCard(self, card):
-        index = -1
-        for i, c in enumerate(self.hand):
-            if c == card:
-                index = i
-                break
-        if index != -1:
-            return self.hand.pop(index)
-        return None
+        code = card.code
+        if not self.counts[code]:
+            return None
+        self.counts[code] -= 1
+        if not self.counts[code]:
+            self.mask &= ~(1 << code)
+        self.size -= 1
+        return card
 
     def numberOfCards(self):
-        return len(self.hand)
+        return self.size
 
 class Deck:
-    # Basic Deck Object
+    # Shoe holding any number of decks, as a bytearray of card codes. Dealing picks a random
+    # remaining card and swaps the last one into its place (Fisher-Yates, one step per deal), so
+    # only the cards that actually get dealt are ever shuffled, and dealing allocates nothing.
     suits = [Suit.HEART, Suit.CLUB, Suit.DIAMOND, Suit.SPADE]
     values = ['A',2,3,4,5,6,7,8,9,10,'J','Q','K']
+    fullDeck = bytes(range(52))
     
     def shuffle(self):
-        # Shuffles the cards
-        return shuffle(self.cards)
+        # Shuffles the remaining cards. Never needed for dealing, which is already random.
+        if self.rng:
+            return self.rng.shuffle(self.codes)
+        return shuffle(self.codes)
     
     def foldInDeck(self):
         # Adds a new deck of cards (52 cards) to the existing deck object
-        for s in self.suits:
-            for v in self.values:
-                self.cards.append(Card(v,s))
-        self.shuffle()
+        self.codes.extend(self.fullDeck)
     
-    def __init__(self, numOfDecks = 1):
-        self.cards = []
+    def __init__(self, numOfDecks = 1, rng = None, seed = None):
+        if seed is not None:
+            rng = Random(seed)
+        self.rng = rng # a random.Random, or None for the module-level generator
+        self.random = rng.random if rng else random
+        self.codes = bytearray()
+        self.refolds = 0
+        self.onRefold = [] # called with the deck whenever it runs out and folds in a new deck
         #initialize with numOfDecks decks
         for k in range (0, numOfDecks):
             self.foldInDeck()
 
     def deal(self):
         # Deal a card from the deck.
-        try:
-            return self.cards.pop()
-        except:
-            # If the deck is out of cards, add and shuffle a new deck and deal from that.
-            print('* No more cards in deck. Folding in a new deck now. *')
+        codes = self.codes
+        if not codes:
+            # If the deck is out of cards, fold in a new deck and deal from that.
             self.foldInDeck()
-            return self.cards.pop()
+            self.refolds += 1
+            for callback in self.onRefold:
+                callback(self)
+        i = int(self.random() * len(codes))
+        last = codes.pop()
+        if i < len(codes):
+            code = codes[i]
+            codes[i] = last
+            return Card._cards[code]
+        return Card._cards[last]
+
+    def __len__(self):
+        return len(self.codes)
     
     def getCards(self):
-        return self.cards
\ No newline at end of file
+        # The cards left in the deck, in no particular order
+        return [Card._cards[code] for code in self.codes]
@@ -0,0 +1,134 @@
+#  © 2018 Matt Fan
+# http://mattfan.me/
+
+import asyncio
+import json
+from argparse import ArgumentParser
+from random import Random
+from server import Server
+from cardobjects import Card, Hand
+from eleusisobjects import Line
+from engine import NO_PLAY
+from bot import HypothesisSpace, Inference
+
+# Local client for server.py. It sits in for a real player: joins a room, plays whenever it's
+# its turn and returns once the round is won. Run it on its own to fill a server with rooms of
+# simulated players, e.g.
+#   python server.py --seats 3 &
+#   python client.py --rooms 200 --players 3
+
+
+class RandomStrategy:
+    # Plays a random card from the hand, and occasionally declares NO PLAY
+    def __init__(self, rng = None, noPlayChance = .05):
+        self.rng = rng if rng else Random()
+        self.noPlayChance = noPlayChance
+
+    def chooseMove(self, message):
+        # Takes the "turn" message sent to this player, returns the message to send back
+        if self.rng.random() < self.noPlayChance:
+            return {'type': 'noplay'}
+        return {'type': 'play', 'card': self.rng.choice(message['hand'])}
+
+
+class InferenceStrategy:
+    # Works out the rule from the results broadcast to the room, like bot.InferenceAgent
+    def __init__(self, space):
+        self.inference = Inference(space)
+        self.line = None
+
+    def chooseMove(self, message):
+        self.inference.observe(self.line)
+        move = self.inference.chooseMove(Hand(Card.parseMany(message['hand'])), self.line.getMainLine()[-1])
+        if move == NO_PLAY:
+            return {'type': 'noplay'}
+        return {'type': 'play', 'card': move.compactFormat()}
+
+    def observe(self, message):
+        # Rebuilds the room's line from the round and result messages
+        if message['type'] == 'round':
+            self.line = Line()
+            self.line.addToMain(Card.parse(message['start']))
+        elif message['type'] == 'result' and self.line is not None:
+            cards = Card.parseMany(message['cards'])
+            if message['outcome'] in ('MAIN', 'PENALTY'):
+                self.line.addToMain(cards[0])
+            elif message['outcome'] in ('SIDE', 'NO_PLAY'):
+                for card in cards:
+                    self.line.addToSide(card)
+
+
+async def send(writer, message):
+    writer.write(json.dumps(message).encode() + b'\n')
+    await writer.drain()
+
+
+async def runClient(name, room, host = '127.0.0.1', port = 8765, path = None, strategy = None, start = False):
+    # Plays one round in the given room. Returns the server's "won" message.
+    strategy = strategy if strategy else RandomStrategy()
+    if path:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    try:
+        await send(writer, {'type': 'join', 'room': room, 'name': name})
+        if start:
+            await send(writer, {'type': 'start'})
+        while True:
+            data = await reader.readline()
+            if not data:
+                raise ConnectionError('The server closed the connection')
+            message = json.loads(data)
+            if hasattr(strategy, 'observe'): # strategies that want to see every message
+                strategy.observe(message)
+            if message['type'] == 'turn' and message['player'] == name:
+                await send(writer, strategy.chooseMove(message))
+            elif message['type'] == 'won':
+                return message
+    finally:
+        writer.close()
+
+
+async def simulate(rooms, players, host = '127.0.0.1', port = 8765, path = None, seed = None, bots = 0):
+    # Fills `rooms` rooms with `players` clients each and plays one round in all of them at once.
+    # The first `bots` seats of each room are InferenceStrategy players, the rest play randomly.
+    # The server must start rounds by itself once a room is full (Server(seats=players)).
+    rng = Random(seed)
+    space = HypothesisSpace.fromRules() if bots else None
+    clients = []
+    for r in range(rooms):
+        for p in range(players):
+            strategy = InferenceStrategy(space) if p < bots else RandomStrategy(Random(rng.random()))
+            clients.append(runClient(f"player{p}", f"room{r}", host, port, path, strategy))
+    return await asyncio.gather(*clients)
+
+
+async def main(args):
+    if args.local:
+        # Run a server in this process too
+        server = Server(turnTimeout = args.timeout, seats = args.players, options = {'starting_hand_size': args.hand_size})
+        listener = await server.listen(args.host, args.port, args.unix, args.backlog)
+        async with listener:
+            results = await simulate(args.rooms, args.players, args.host, args.port, args.unix, args.seed, args.bots)
+    else:
+        results = await simulate(args.rooms, args.players, args.host, args.port, args.unix, args.seed, args.bots)
+    winners = {}
+    for message in results[::args.players]:
+        winners[message['winner']] = winners.get(message['winner'], 0) + 1
+    print(f"Played {args.rooms} rooms. Wins by seat: {winners}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description='Fill an Eleusis server with simulated players.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='connect to this Unix socket path instead of TCP')
+    parser.add_argument('--rooms', type=int, default=1)
+    parser.add_argument('--players', type=int, default=3, help='players per room')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--bots', type=int, default=0, help='seats per room played by the rule-inference bot')
+    parser.add_argument('--local', action='store_true', help='also run the server in this process')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds per turn (with --local)')
+    parser.add_argument('--hand-size', type=int, default=12, help='starting hand size (with --local)')
+    parser.add_argument('--backlog', type=int, default=1024, help='connections that can wait to be accepted (with --local)')
+    asyncio.run(main(parser.parse_args()))
@@ -3,45 +3,42 @@
 
 # Fun Fact: In my sophomore year in college, I ran an incubator (https://startupshell.org/) 
 
-from random import choice as randomChoice
-from os import system, name
+from random import Random
 from time import sleep
 from rules import rules as myRules
-from cardobjects import Card, Color, Suit, Hand, Deck
+from cardobjects import Card, Color, Suit, Hand, Deck, CardParseError
 from eleusisobjects import Rule, Line, Players, Player
+from engine import Engine, Outcome, IllegalMove, NO_PLAY
+from renderer import Renderer
+from results import ResultsStore
 
-# This file includes main game logic.
+# This file is the terminal front-end. Game logic lives in engine.py.
 
 class Game:
     def __init__(self, rules = myRules, options = {}):
         self.rules = rules
+        rows = options.get('line_rows', 10) # rows of the line shown each turn
+        if options.get('bounded_line'):
+            # keep every row on screen in memory, so drawing a turn never reads the spill file
+            options = dict(options, bounded_line = max(int(options['bounded_line']), rows))
         self.options = options
-        self.STARTING_HAND_SIZE = 12 if 'starting_hand_size' not in self.options else self.options['starting_hand_size']
+        self.rng = Random(options['seed']) if 'seed' in options else Random()
+        self.renderer = Renderer(rows = rows)
 
-    @classmethod
-    def clearScreen(cls):
+    def clearScreen(self):
         # Clears the screen. Keeps players from seeing each other's hands, looks nice. 
-        _ = system('cls') if name == 'nt' else system('clear') 
+        self.renderer.clear()
     
     def initializeRound(self, rule):
-        self.roundActive = True
-        self.winner = None
-        self.rule = rule
-        self.deck = Deck(int(len(self.players)*self.STARTING_HAND_SIZE/40) + 1) # Determine how many decks to fold in to start
-        self.line = Line()
-        Rule.setLine(self.line)
-        for player in self.players:
-            player.hand = Hand()
-            for n in range(0, self.STARTING_HAND_SIZE ):
-                player.hand.addCard(self.deck.deal())
-        self.line.addToMain(self.deck.deal())
+        self.engine.startRound(rule)
+        self.engine.deck.onRefold.append(lambda deck: print('* No more cards in deck. Folding in a new deck now. *'))
         while True: # Keep cycling player turns until someone wins
-            self.playTurn(self.players.nextPlayer())
-            if self.roundActive == False:
+            self.playTurn(self.engine.currentPlayer())
+            if self.engine.roundActive == False:
                 self.clearScreen()
-                print(f"\n{self.winner.name} has WON this round!\nThe rule was {self.rule.name}\n")
+                print(f"\n{self.engine.winner.name} has WON this round!\nThe rule was {self.engine.rule.name}\n")
                 print('Cumulative scores for the entire game:')
-                ranked = sorted(self.players.getPlayers(), key=lambda k: k.score, reverse=True)
+                ranked = self.engine.ranking()
                 for player in ranked:
                     print(f"    {player.name}    :   {player.score}")
                 print(f"\n{ranked[0].name} is leading for the game, with {ranked[0].score} points\n")
@@ -49,7 +46,7 @@ class Game:
                 while makingChoice:
                     choice = input('Do you want to play another round? (y/n)')
                     if choice == 'y' or choice == 'Y':
-                        self.initializeRound(randomChoice(self.rules)) # Call a new round.
+                        self.initializeRound(self.rng.choice(self.rules)) # Call a new round.
                         makingChoice = False # Otherwise, exit.
                     elif choice == 'n' or choice =='N': 
                         return None
@@ -90,84 +87,63 @@ class Game:
                     print("I didn't recognize that command.")
         print("Great! Let's get started!")
 
-        self.players = Players(players)
+        self.engine = Engine(players, self.options, self.rng)
+        # options['results_db']: an SQLite file every round's results are saved to, as soon as it ends
+        store = ResultsStore(self.options['results_db'], batchSize = 1).attach(self.engine) if 'results_db' in self.options else None
 
-        self.initializeRound(randomChoice(self.rules)) # recursively calls new rounds until players quit
+        try:
+            self.initializeRound(self.rng.choice(self.rules)) # recursively calls new rounds until players quit
+        finally:
+            self.engine.abandonRound() # if the game was stopped mid-round, that round is saved with no winner
+            if store:
+                store.close()
         self.clearScreen()
         print('\nThanks for playing Eleusis!') # exit program
         sleep(2)
 
-    def playerWins(self, player):
-        # Called when a player wins! Update scores and break out of player turns loop
-        player.hand = Hand()
-        print(f"Congrats {player.name}! You've won this round!")
-        self.winner = player
-        for p in self.players:
-            p.score += self.STARTING_HAND_SIZE - p.hand.numberOfCards()
-        self.roundActive = False
-        sleep(1)
-
     def playTurn(self, player):
         # Play a single turn
         self.clearScreen()
-        self.rule.setHand(player.hand)
         input(f"\nHi {player.name}, it's your turn! Press ENTER to continue.")
-        self.clearScreen()
-        print(f"\n--- It's {player.name}'s Turn! ---\nPlayer Cards:")
-        cardCountString = "    |"
-        for p in self.players:
-            cardCountString += f"    {p.name}: {p.hand.numberOfCards()}    |" 
-        print(cardCountString)
-        print('\nTHE LINE (most recent at top): ')
-        self.line.printLine();
-        print('\nYOUR HAND: ')
-        for card in player.hand:
-            print(f"    {card.fancyFormat()}")     
-        print('')
+        self.renderer.show(self.renderer.turnText(self.engine, player))
         while (True):
             choice = input('> Type the card you want to play (or NO PLAY): ') 
-            chosenCard = Card.parse(choice) #If invalid parse, this just evaluates to None
-            if choice == 'NO PLAY':
-                if player.hand.odds(self.rule) == 0:
-                    if player.hand.numberOfCards() == 1:
-                        self.playerWins(player)
-                        break
-                    cardsToReplace = len(player.hand)
-                    for c in player.hand:
-                        self.line.addToSide(c)
-                    player.hand = Hand()
-                    for i in range(1, cardsToReplace):
-                        player.hand.addCard(self.deck.deal())
-                    print("Correct! The DEALER moves your cards onto the SIDE LINE, and replaces your hand sans one card.")
-                    break
+            try:
+                chosenCard = Card.parse(choice)
+            except CardParseError:
+                chosenCard = None
+            try:
+                if choice == NO_PLAY:
+                    turn = self.engine.declareNoPlay()
+                elif chosenCard:
+                    turn = self.engine.playCard(chosenCard)
                 else:
-                    correctCard = player.hand.removeAPassingCard(self.rule)
-                    self.line.addToMain(correctCard)
-                    player.hand.addCard(self.deck.deal())
-                    print('Sorry, you could have played something.')
-                    print(f'The dealer moves the {correctCard.format()} from your hand to the MAIN LINE, and replaces it.')
-                    break
-            elif chosenCard and player.hand.hasCard(chosenCard) and chosenCard.passesRule(self.rule):
-                if player.hand.numberOfCards() == 1:
-                    self.playerWins(player)
-                    break
-                self.line.addToMain(player.hand.removeCard(chosenCard))
-                print(f'Correct! You move the {chosenCard.format()} onto the MAIN LINE.')
-                break
-            elif chosenCard and player.hand.hasCard(chosenCard):
-                self.line.addToSide(player.hand.removeCard(chosenCard))
-                player.hand.addCard(self.deck.deal())
-                print(f'Sorry, that selection fails the rule. The {chosenCard.format()} is moved to the SIDE LINE and replaced.')
-                break
-            elif chosenCard:
+                    print("    Which card is that? Please type the card as it appears in YOUR HAND, e.g. 'Ace of Hearts', '(A♥)' or 'AH'.")
+                    print("    You could also type 'NO PLAY' if you think there aren't any legal moves left.")  
+                    continue
+            except IllegalMove:
                 print("    You don't have that card in your hand! Please choose a valid card.")
-            else:
-                print("    Which card is that? Please type the card exactly as it appears in YOUR HAND.")
-                print("    You could also type 'NO PLAY' if you think there aren't any legal moves left.")  
+                continue
+            self.describeTurn(turn)
+            break
         print('')
-        if self.roundActive:
+        if self.engine.roundActive:
             input("That ends your turn! Press ENTER once you're done, then pass it over to the next player\n>")
-    # Face cards
+
+    def describeTurn(self, turn):
+        # Tell the player what happened on their turn
+        if turn.outcome == Outcome.WIN:
+            print(f"Congrats {turn.player.name}! You've won this round!")
+            sleep(1)
+        elif turn.outcome == Outcome.NO_PLAY:
+            print("Correct! The DEALER moves your cards onto the SIDE LINE, and replaces your hand sans one card.")
+        elif turn.outcome == Outcome.PENALTY:
+            print('Sorry, you could have played something.')
+            print(f'The dealer moves the {turn.cards[0].format()} from your hand to the MAIN LINE, and replaces it.')
+        elif turn.outcome == Outcome.MAIN:
+            print(f'Correct! You move the {turn.cards[0].format()} onto the MAIN LINE.')
+        else:
+            print(f'Sorry, that selection fails the rule. The {turn.cards[0].format()} is moved to the SIDE LINE and replaced.')
 
 if __name__ == "__main__":
     
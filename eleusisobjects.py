@@ -3,9 +3,10 @@
 
 # Fun Fact: Last Spring, I designed and built an image-projecting drone from scratch (http://mattfan.me/portfolio/hovar/)
 
-from itertools import cycle
-from functools import reduce
-from cardobjects import Card, Color, Suit, Hand, Deck
+from collections import OrderedDict, deque
+from collections.abc import Sequence
+from tempfile import TemporaryFile
+from cardobjects import Card, Color, Suit, Hand, Deck, ALL_CARDS, codesIn
 
 class Player:
     def __init__(self, name, hand=Hand()):
@@ -19,10 +20,12 @@ class Players:
         self.players = {}
         for player in players:
             self.players[player] = Player(player)
-        self.player_names = cycle(players)
+        self.player_names = list(players)
+        self.turn = -1 # index into player_names of whoever's turn it is
     
     def nextPlayer(self):
-        return self.players[next(self.player_names)]
+        self.turn = (self.turn + 1) % len(self.player_names)
+        return self.players[self.player_names[self.turn]]
     
     # Apply some callback that modifies each player
     # Callback takes a Player object, and returns nothing 
@@ -44,21 +47,103 @@ class Players:
         return len(self.players)
     
 
+class LineStats:
+    # Running totals a Line keeps up to date as cards are added, so rules that depend on the whole
+    # history can ask in O(1) instead of rescanning the line. Rules get them as m.stats (or d.stats).
+    def __init__(self):
+        self.mainSuits = { suit: 0 for suit in Suit } # cards of each suit on the MAIN LINE
+        self.sideSuits = { suit: 0 for suit in Suit }
+        self.mainColors = { color: 0 for color in Color }
+        self.sideColors = { color: 0 for color in Color }
+        self.mainRanks = [0] * 14 # indexed by rank, 1-13
+        self.sideRanks = [0] * 14
+        self.lastRank = [None] * 14 # MAIN LINE index of the latest card of each rank
+        # How many cards at the end of the MAIN LINE share the last card's color, suit and parity
+        self.colorRun = 0
+        self.suitRun = 0
+        self.parityRun = 0
+        self.last = None
+        self.mainCount = 0
+
+    def addMain(self, card):
+        last = self.last
+        self.mainSuits[card.suit] += 1
+        self.mainColors[card.color] += 1
+        self.mainRanks[card.rank] += 1
+        self.lastRank[card.rank] = self.mainCount
+        self.colorRun = self.colorRun + 1 if last is not None and last.color == card.color else 1
+        self.suitRun = self.suitRun + 1 if last is not None and last.suit == card.suit else 1
+        self.parityRun = self.parityRun + 1 if last is not None and last.rank % 2 == card.rank % 2 else 1
+        self.last = card
+        self.mainCount += 1
+
+    def addSide(self, card):
+        self.sideSuits[card.suit] += 1
+        self.sideColors[card.color] += 1
+        self.sideRanks[card.rank] += 1
+
+
+class LineView(Sequence):
+    # Read-only window onto one of the lists a Line keeps up to date.
+    # Handing one of these to a rule costs O(1), no matter how long the line is.
+    __slots__ = ('_cards', 'stats')
+
+    def __init__(self, cards, stats = None):
+        self._cards = cards
+        self.stats = stats # the Line's LineStats
+
+    def __getitem__(self, index):
+        return self._cards[index]
+
+    def __len__(self):
+        return len(self._cards)
+
+    def __iter__(self):
+        return iter(self._cards)
+
+    def __reversed__(self):
+        return reversed(self._cards)
+
+    def __eq__(self, other):
+        if isinstance(other, LineView):
+            other = other._cards
+        return self._cards == other
+
+    def __repr__(self):
+        return f"LineView({self._cards!r})"
+
+
 class Line:
     def __init__(self):
         self.line = []
+        # Main line and full line (main + side, in order played) are maintained as cards are added
+        self.mainLine = []
+        self.fullLine = []
+        self.stats = LineStats()
+        self.mainView = LineView(self.mainLine, self.stats)
+        self.fullView = LineView(self.fullLine, self.stats)
     
     def addToMain(self, card):
         self.line.append({'main': card, 'side':[]})
+        self.mainLine.append(card)
+        self.fullLine.append(card)
+        self.stats.addMain(card)
     
     def addToSide(self, card):
         self.line[-1]['side'].append(card)
+        self.fullLine.append(card) # side cards always trail the most recent main card
+        self.stats.addSide(card)
 
     def getMainLine(self):
-        return list(map(lambda x: x['main'], self.line))
+        return self.mainView
     
     def getFullLine(self):
-        return reduce(lambda acc, curr: acc + [curr['main']] + curr['side'], self.line, [])
+        return self.fullView
+
+    def rows(self, start = 0):
+        # (main card, side cards) for each MAIN LINE card from index `start` on, oldest first
+        for row in self.line[start:]:
+            yield row['main'], row['side']
 
     # Confusing nomenclature- prints out the LINE object, but takes more than one line on the terminal
     def printLine(self):
@@ -69,34 +154,444 @@ class Line:
                 sideLine += f' {card.shortFormat()}'
             print(f"    {row['main'].fancyFormat():27}| {sideLine}")
 
+    def close(self):
+        pass # nothing to release; see BoundedLine
+
+
+SIDE_FLAG = 0x40 # set on side cards in a spill file
+_flagSide = bytes(code | SIDE_FLAG for code in range(256))
+CHECKPOINT = 256 # a BoundedLine remembers where every CHECKPOINT-th spilled row starts
+
+
+class BoundedView(Sequence):
+    # Read-only view onto a BoundedLine's main or full line. Recent cards come from memory, older
+    # ones from the spill file.
+    __slots__ = ('line', 'full', 'stats')
+
+    def __init__(self, line, full):
+        self.line = line
+        self.full = full
+        self.stats = line.stats
+
+    def __len__(self):
+        return self.line.fullCount if self.full else self.line.mainCount
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError('line index out of range')
+        return Card._cards[self.line.codeAt(index, self.full)]
+
+    def __iter__(self):
+        for code in self.line.codes(self.full):
+            yield Card._cards[code]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+
+class BoundedLine(Line):
+    # Line that keeps only its last `keep` rows in memory, each a bytearray of card codes (the main
+    # card, then its side cards). Older rows are appended to a spill file, one byte per card with
+    # SIDE_FLAG set on side cards, and read back lazily when a rule or replay asks for them.
+    # Memory use is a few bytes per CHECKPOINT rows, so a rule or renderer that reads back into the
+    # file only reads from the checkpoint before the row it wants.
+    def __init__(self, keep = 1, path = None):
+        Line.__init__(self)
+        self.keep = max(keep, 1)
+        self.recent = deque()
+        self.file = open(path, 'w+b') if path else TemporaryFile()
+        self.appending = True # False after a read moves the file position away from the end
+        self.spilledMain = 0
+        self.spilledFull = 0
+        self.checkpoints = [] # checkpoints[n]: offset in the file of spilled row n * CHECKPOINT
+        self.mainCount = 0
+        self.fullCount = 0
+        self.mainLine = self.mainView = BoundedView(self, False)
+        self.fullLine = self.fullView = BoundedView(self, True)
+
+    @property
+    def line(self):
+        # Every row as a {'main', 'side'} dict, like Line.line. Reads the whole spill file.
+        return [{'main': main, 'side': side} for main, side in self.rows()]
+
+    @line.setter
+    def line(self, rows):
+        if rows:
+            raise AttributeError("a BoundedLine's rows can only be added with addToMain and addToSide")
+
+    def addToMain(self, card):
+        self.recent.append(bytearray((card.code,)))
+        self.mainCount += 1
+        self.fullCount += 1
+        self.stats.addMain(card)
+        if len(self.recent) > self.keep:
+            row = self.recent.popleft()
+            if not self.appending:
+                self.file.seek(0, 2) # a seek flushes the write buffer, so only seek after reads
+                self.appending = True
+            if self.spilledMain % CHECKPOINT == 0:
+                self.checkpoints.append(self.spilledFull)
+            self.file.write(row[:1] + row[1:].translate(_flagSide))
+            self.spilledMain += 1
+            self.spilledFull += len(row)
+
+    def addToSide(self, card):
+        self.recent[-1].append(card.code)
+        self.fullCount += 1
+        self.stats.addSide(card)
+
+    def spilled(self, start = 0, chunkSize = 1 << 16):
+        # Reads the spill file from byte `start` on, in chunks
+        self.file.flush()
+        self.appending = False
+        position = start
+        while position < self.spilledFull:
+            self.file.seek(position)
+            chunk = self.file.read(min(chunkSize, self.spilledFull - position))
+            position += len(chunk)
+            yield chunk
+
+    def spilledRows(self, start = 0, chunkSize = 1 << 16):
+        # (main code, side codes) for each spilled row from MAIN LINE index `start` on. Reading
+        # starts at the checkpoint before `start`, so it skips over fewer than CHECKPOINT rows.
+        checkpoint = start // CHECKPOINT
+        if checkpoint >= len(self.checkpoints):
+            return
+        index = checkpoint * CHECKPOINT - 1
+        main, side = None, []
+        for chunk in self.spilled(self.checkpoints[checkpoint], chunkSize):
+            for code in chunk:
+                if code & SIDE_FLAG:
+                    side.append(code & ~SIDE_FLAG)
+                    continue
+                if index >= start:
+                    yield main, side
+                main, side = code, []
+                index += 1
+        if main is not None and index >= start:
+            yield main, side
+
+    def codeAt(self, index, full):
+        # Code of the card at a (non-negative, in range) index of the full or main line
+        if full:
+            offset = index - self.spilledFull
+            if offset < 0:
+                return next(self.spilled(index, 1))[0] & ~SIDE_FLAG
+            for row in self.recent:
+                if offset < len(row):
+                    return row[offset]
+                offset -= len(row)
+            raise IndexError('line index out of range')
+        offset = index - self.spilledMain
+        if offset >= 0:
+            return self.recent[offset][0]
+        return next(self.spilledRows(index, 1 << 12))[0]
+
+    def codes(self, full):
+        # Every code on the full or main line, oldest first
+        for chunk in self.spilled():
+            for code in chunk:
+                if full:
+                    yield code & ~SIDE_FLAG
+                elif not code & SIDE_FLAG:
+                    yield code
+        for row in list(self.recent):
+            if full:
+                yield from row
+            else:
+                yield row[0]
+
+    def rows(self, start = 0):
+        if start < self.spilledMain:
+            for main, side in self.spilledRows(start):
+                yield Card._cards[main], [Card._cards[c] for c in side]
+        for row in list(self.recent)[max(start - self.spilledMain, 0):]:
+            yield Card._cards[row[0]], [Card._cards[c] for c in row[1:]]
+
+    def printLine(self):
+        print(f"   {'MAIN LINE:':27}   SIDE LINE:")
+        for main, side in reversed(list(self.rows(self.spilledMain))):
+            print(f"    {main.fancyFormat():27}| {''.join(' ' + card.shortFormat() for card in side)}")
+        if self.spilledMain:
+            print(f"    ... and {self.spilledMain} earlier MAIN LINE cards")
+
+    def close(self):
+        self.file.close()
+
+
+# Bit for each card in a 52-bit accept mask (bit n is set if the card with code n passes)
+cardBits = [(card, 1 << card.code) for card in Card.allCards()]
+
+
+def evaluateRow(f, m, d, h):
+    # Runs a rule callback against every candidate card and packs the verdicts into an accept mask
+    row = 0
+    for card, bit in cardBits:
+        if f(card, m, d, h):
+            row |= bit
+    return row
+
+
+class _OutOfWindow(Exception):
+    pass
+
+
+class _Probe:
+    # Stand-in for the line and hand while working out how far back a rule looks.
+    # Anything other than m[-1] marks the rule as not compilable.
+    def __init__(self, last = None):
+        self.last = last
+        self.deepest = 0
+        self.escaped = False # set even if the rule swallows the exception
+
+    def __getitem__(self, index):
+        if index == -1 and self.last is not None:
+            self.deepest = 1
+            return self.last
+        self.escaped = True
+        raise _OutOfWindow()
+
+    def __len__(self):
+        self.escaped = True
+        raise _OutOfWindow()
+
+    def __iter__(self):
+        self.escaped = True
+        raise _OutOfWindow()
+
+    def __contains__(self, item):
+        self.escaped = True
+        raise _OutOfWindow()
+
+    def __getattr__(self, name):
+        self.escaped = True
+        raise _OutOfWindow()
+
+
+class Context:
+    # What a rule is evaluated against: the line, and the hand of the player whose turn it is.
+    # Each game keeps its own, so any number of games can share the same Rule objects.
+    def __init__(self, line = None, hand = None, cache = None):
+        self.line = line
+        self.hand = hand
+        self.cache = cache # optional VerdictCache, which can be shared between games
+
+
+class VerdictCache:
+    # Bounded LRU memo of verdicts, keyed on the rule and the part of the line state it depends on.
+    # Each entry holds the verdicts for one state as two masks (cards tested so far, cards that
+    # passed), so candidates are only ever tested once per state and a hand is answered at once.
+    #   - rules with a window of 2 or more: keyed on the last `window` MAIN LINE cards, so entries
+    #     are shared across turns, players and rounds
+    #   - rules known (from their footprint) to read the full line but not the hand: keyed on the
+    #     line and its length, which helps within a turn
+    # Everything else bypasses the cache: rules with a window of 0 or 1 are already a list lookup,
+    # and a rule that might read the hand can't be keyed safely.
+    def __init__(self, maxsize = 4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+
+    def key(self, rule, m, d):
+        if rule.window is not None:
+            if rule.window < 2:
+                return None
+            return (rule, tuple(card.code for card in m[-rule.window:]))
+        footprint = rule.footprint
+        if footprint is None or footprint.usesHand:
+            return None
+        return (rule, id(d), len(d))
+
+    def acceptMask(self, rule, m, d, h, within):
+        # Mask of the cards in `within` that pass the rule in this state, or None if the rule
+        # bypasses the cache
+        key = self.key(rule, m, d)
+        if key is None:
+            self.bypasses += 1
+            return None
+        entry = self.entries.get(key)
+        if entry is None:
+            # [cards tested, cards passed], plus the line for entries keyed on it: holding on to the
+            # line keeps its id from being reused. Entries keyed on card codes don't pin any line.
+            entry = self.entries[key] = [0, 0] if rule.window is not None else [0, 0, d]
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last = False)
+                self.evictions += 1
+        else:
+            self.entries.move_to_end(key)
+        missing = within & ~entry[0]
+        if not missing:
+            self.hits += 1
+            return entry[1] & within
+        self.misses += 1
+        f = rule.f
+        for code in codesIn(missing):
+            if f(Card.fromCode(code), m, d, h):
+                entry[1] |= 1 << code
+        entry[0] |= missing
+        return entry[1] & within
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'bypasses': self.bypasses,
+                'evictions': self.evictions, 'hitRate': self.hits / lookups if lookups else 0}
+
 
 class Rule:
-    hand = None
-    line = None
+    # Context used when test() isn't given one. Only for code that runs a single game at a time.
+    context = Context()
     # Rule object for Eleusis
     @classmethod
     def setLine(cls, line):
-        cls.line = line
+        cls.context.line = line
 
     @classmethod
     def setHand(cls, hand): #Set the fourth arg for callback f (player hand)
-        cls.hand = hand
+        cls.context.hand = hand
 
-    def __init__(self, name, callback):
+    def __init__(self, name, callback, window = None):
         self.name = name
         self.f = callback
+        # How many cards back along the MAIN LINE the rule looks (0 = only the card played), if the
+        # rule depends on nothing else. Rules with a window compile to a lookup table of accept masks.
+        self.window = window
+        self.footprint = None # what the rule depends on, when that's known (see ruledsl.py)
+        self.table = None
+        self.parts = None # (left, right, op) for a compiled composite (see combine)
+        self.buildRow = lambda m, d, h: evaluateRow(self.f, m, d, h)
+        if window is not None:
+            self.compile()
+
+    def lookback(self):
+        # How many MAIN LINE cards back the rule is known to look, or None if that isn't known
+        # (or it reads the full line, which can reach back any distance)
+        if self.window is not None:
+            return self.window
+        if self.footprint is not None and not self.footprint.usesLine:
+            return self.footprint.lookback
+        return None
+
+    def detectWindow(self):
+        # Works out the window by running the callback on every (last card, candidate) pair with the
+        # line and hand stubbed out. Returns 0 or 1, or None if the rule needs anything more.
+        deepest = 0
+        for last in Card.allCards():
+            m, d, h = _Probe(last), _Probe(), _Probe()
+            for card in Card.allCards():
+                try:
+                    self.f(card, m, d, h)
+                except _OutOfWindow:
+                    return None
+                if m.escaped or d.escaped or h.escaped:
+                    return None
+            deepest = max(deepest, m.deepest)
+        return deepest
+
+    def compile(self):
+        # Builds the lookup table: one accept mask per last MAIN LINE card for windows of 0 or 1,
+        # or masks keyed on the last `window` card codes, filled in as states come up, for longer ones.
+        if self.window is None:
+            self.window = self.detectWindow()
+        if self.window is None:
+            return self
+        if self.window >= 2:
+            self.table = {}
+            return self
+        rows = []
+        for last in (Card.allCards() if self.window else Card.allCards()[:1]):
+            line = Line()
+            line.addToMain(last)
+            rows.append(self.buildRow(line.getMainLine(), line.getFullLine(), None))
+        self.table = rows
+        return self
+
+    def row(self, m, d, h):
+        # Accept mask over all 52 cards for the given main line, full line and hand
+        if self.table is None:
+            return self.buildRow(m, d, h)
+        if self.window < 2:
+            return self.table[m[-1].code if self.window else 0]
+        key = tuple(card.code for card in m[-self.window:])
+        row = self.table.get(key)
+        if row is None:
+            row = self.table[key] = self.buildRow(m, d, h)
+        return row
+
+    def test(self, card, context = None):
+        if context is None:
+            context = self.context
+        line = context.line
+        if context.cache is not None:
+            passed = context.cache.acceptMask(self, line.getMainLine(), line.getFullLine(), context.hand, 1 << card.code)
+            if passed is not None:
+                return passed != 0
+        if self.table is None:
+            return self.f(card, line.getMainLine(), line.getFullLine(), context.hand)
+        return self.row(line.getMainLine(), line.getFullLine(), context.hand) >> card.code & 1 == 1
+
+    def testMany(self, cards, context = None):
+        # Verdicts for a batch of candidate cards against one line state, in the same order.
+        # The line and hand are looked at once for the whole batch, and each distinct card tested once.
+        within = 0
+        for card in cards:
+            within |= 1 << card.code
+        mask = self.acceptMask(context, within)
+        return [mask >> card.code & 1 == 1 for card in cards]
+
+    def acceptMask(self, context = None, within = ALL_CARDS):
+        # Mask of the cards in `within` (every card by default) that pass the rule
+        if context is None:
+            context = self.context
+        line = context.line
+        m, d, h = line.getMainLine(), line.getFullLine(), context.hand
+        if context.cache is not None:
+            passed = context.cache.acceptMask(self, m, d, h, within)
+            if passed is not None:
+                return passed
+        if self.table is not None:
+            return self.row(m, d, h) & within
+        mask = 0
+        for code in codesIn(within):
+            if self.f(Card.fromCode(code), m, d, h):
+                mask |= 1 << code
+        return mask
+
+    def combine(self, other, name, callback, op):
+        # Composite of two rules. If both are compiled, so is the composite: its masks are the
+        # parts' masks combined with op, so testing it is still one lookup.
+        rule = Rule(name, callback)
+        if self.window is None or other.window is None:
+            return rule
+        rule.window = max(self.window, other.window)
+        rule.parts = (self, other, op)
+        if rule.window < 2:
+            mine = self.table if self.window else self.table * 52
+            theirs = other.table if other.window else other.table * 52
+            rule.table = [op(a, b) for a, b in zip(mine, theirs)]
+            if rule.window == 0:
+                rule.table = rule.table[:1]
+        else:
+            rule.table = {}
+            rule.buildRow = lambda m, d, h: op(self.row(m, d, h), other.row(m, d, h))
+        return rule
 
-    def test(self, card): # Dependent on mainline implementation in eleusis.py file :(. Potential refactor
-        return self.f(card, self.line.getMainLine(), self.line.getFullLine(), self.hand)
-    
     def merge(self, other): # Creates a stricter composite rule from logical and of two other rules
-        return Rule(f"({self.name} and {other.name})", lambda c, m, d, h: self.f(c,m,d,h) and other.f(c,m,d,h))
+        return self.combine(other, f"({self.name} and {other.name})", lambda c, m, d, h: self.f(c,m,d,h) and other.f(c,m,d,h), lambda a, b: a & b)
 
     def overlay(self, other): # Creates a more lenient rule from logical or of two other
-        return Rule(f"({self.name} or {other.name})", lambda c, m, d, h: self.f(c,m,d,h) or other.f(c,m,d,h))
+        return self.combine(other, f"({self.name} or {other.name})", lambda c, m, d, h: self.f(c,m,d,h) or other.f(c,m,d,h), lambda a, b: a | b)
 
-    # def odds(self): # Tests the odds of a rule against a new deck of cards
-    #     try:
-    #         return Card.odds(Deck(1).getCards(), self) # TODO: write tests
-    #     except:
-    #         return -1
+    def odds(self, depth = 1): # Chance that a random card passes, over every possible last `depth` cards of the MAIN LINE
+        from analysis import analyze
+        return analyze(self, depth).passProbability()
@@ -0,0 +1,242 @@
+#  © 2018 Matt Fan
+# http://mattfan.me/
+
+from enum import Enum
+from random import Random, choice as randomChoice
+from cardobjects import Card, Hand, Deck
+from eleusisobjects import Line, BoundedLine, Players, Context
+
+# Headless game logic. The Engine knows the rules of Eleusis Express but never prints, sleeps or
+# asks for input, so rounds can be driven by anything: the terminal game in eleusis.py, or
+# Agents playing thousands of rounds a second.
+
+NO_PLAY = 'NO PLAY'
+
+
+class Outcome(Enum):
+    MAIN = 0      # card passed and went onto the MAIN LINE
+    SIDE = 1      # card failed, went onto the SIDE LINE and was replaced
+    PENALTY = 2   # wrong NO PLAY; the dealer moved a passing card onto the MAIN LINE and replaced it
+    NO_PLAY = 3   # correct NO PLAY; the hand went onto the SIDE LINE and was replaced sans one card
+    WIN = 4       # the player got rid of their last card
+
+
+class IllegalMove(Exception):
+    # Raised when a player tries to play a card they don't have
+    pass
+
+
+class Turn:
+    # Record of a single turn, returned by Engine.playCard and Engine.declareNoPlay
+    def __init__(self, player, outcome, cards, dealt):
+        self.player = player
+        self.outcome = outcome
+        self.cards = cards # cards that left the player's hand this turn
+        self.dealt = dealt # cards the dealer handed to the player this turn
+
+
+class Engine:
+    def __init__(self, players, options = {}, rng = None):
+        self.players = Players(players)
+        self.options = options
+        self.rng = rng if rng else Random() # every shuffle in this engine's rounds comes from here
+        self.STARTING_HAND_SIZE = 12 if 'starting_hand_size' not in self.options else self.options['starting_hand_size']
+        self.roundActive = False
+        self.winner = None
+        self.roundScores = {} # player name -> points scored in the last round won
+        self.rule = None
+        self.line = None
+        self.player = None
+        # This engine's line and hand, for evaluating the rule. options['verdict_cache'] can be a
+        # VerdictCache shared with other engines.
+        self.context = Context(cache = self.options.get('verdict_cache'))
+        self.onRoundStart = [] # called with the engine once a round has been dealt
+        self.onTurn = [] # called with the engine and the Turn after every turn
+        self.onRoundEnd = [] # called with the engine once a round is won or abandoned
+        self.version = 0 # bumped whenever the line or a hand may have changed
+        self.acceptRow = 0 # for compiled rules: every card that passes right now...
+        self.acceptRowAt = None # ...worked out when the MAIN LINE was this long
+        self.playableCache = {} # for other rules: player name -> (version, mask)
+
+    def startRound(self, rule):
+        self.roundActive = True
+        self.winner = None
+        self.turns = 0
+        self.rule = rule
+        if self.line is not None:
+            self.line.close() # the last round's line is done with
+        self.roundScores = {}
+        self.deck = Deck(int(len(self.players)*self.STARTING_HAND_SIZE/40) + 1, self.rng) # Determine how many decks to fold in to start
+        self.line = self.newLine(rule)
+        self.context.line = self.line
+        for player in self.players:
+            player.hand = Hand()
+            for n in range(0, self.STARTING_HAND_SIZE):
+                player.hand.addCard(self.deck.deal())
+        self.line.addToMain(self.deck.deal())
+        self.player = self.players.nextPlayer()
+        self.acceptRowAt = None
+        self.version += 1
+        for callback in self.onRoundStart:
+            callback(self)
+
+    def newLine(self, rule):
+        # With options['bounded_line'] (True, or a number of rows to keep at least), only as many
+        # rows as the rule looks back at are kept in memory, and the rest of the line goes to disk.
+        # A rule that might read anywhere along the line would go to disk on every evaluation, so
+        # it always gets a plain Line.
+        keep = self.options.get('bounded_line')
+        lookback = rule.lookback()
+        if not keep or lookback is None:
+            return Line()
+        return BoundedLine(max(lookback, int(keep)))
+
+    def currentPlayer(self):
+        return self.player
+
+    def getPlayers(self):
+        return self.players.getPlayers()
+
+    def ranking(self):
+        return sorted(self.players.getPlayers(), key=lambda k: k.score, reverse=True)
+
+    def isLegal(self, card):
+        # True if the current player can put this card down (whether or not it passes the rule)
+        return self.roundActive and self.player.hand.hasCard(card)
+
+    def playCard(self, card):
+        # The current player plays a card from their hand
+        if not self.roundActive:
+            raise IllegalMove('The round is over')
+        player = self.player
+        if not player.hand.hasCard(card):
+            raise IllegalMove(f"{player.name} doesn't have the {card.format()}")
+        if self.playable(player) >> card.code & 1:
+            if player.hand.numberOfCards() == 1:
+                return self.playerWins(player, [card])
+            self.line.addToMain(player.hand.removeCard(card))
+            return self.endTurn(Turn(player, Outcome.MAIN, [card], []))
+        self.line.addToSide(player.hand.removeCard(card))
+        return self.endTurn(Turn(player, Outcome.SIDE, [card], [self.dealTo(player)]))
+
+    def declareNoPlay(self):
+        # The current player claims that nothing in their hand passes the rule
+        if not self.roundActive:
+            raise IllegalMove('The round is over')
+        player = self.player
+        passing = self.playable(player)
+        if not passing:
+            if player.hand.numberOfCards() == 1:
+                return self.playerWins(player, list(player.hand))
+            cards = list(player.hand)
+            for c in cards:
+                self.line.addToSide(c)
+            player.hand = Hand()
+            dealt = [self.dealTo(player) for i in range(1, len(cards))]
+            return self.endTurn(Turn(player, Outcome.NO_PLAY, cards, dealt))
+        correctCard = player.hand.removeCard(Card.fromCode((passing & -passing).bit_length() - 1))
+        self.line.addToMain(correctCard)
+        return self.endTurn(Turn(player, Outcome.PENALTY, [correctCard], [self.dealTo(player)]))
+
+    def playable(self, player = None):
+        # Mask of the cards in the player's hand (the current player's by default) that pass the rule
+        # right now. A compiled rule only depends on the end of the MAIN LINE, so its accept mask is
+        # worked out once each time the MAIN LINE grows, and each player's playable cards are that
+        # ANDed with their hand's mask. Anything else is tested against the hand at most once a turn.
+        # With a VerdictCache, every call goes to the rule and its cache instead, since the cache
+        # already remembers verdicts (across games too) and keeps count of its hits.
+        player = player if player is not None else self.player
+        rule = self.rule
+        if self.context.cache is not None:
+            return rule.acceptMask(self.contextFor(player), player.hand.mask)
+        if rule.table is not None:
+            length = len(self.line.getMainLine())
+            if self.acceptRowAt != length:
+                self.acceptRow = rule.acceptMask(self.contextFor(player))
+                self.acceptRowAt = length
+            return self.acceptRow & player.hand.mask
+        cached = self.playableCache.get(player.name)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+        mask = rule.acceptMask(self.contextFor(player), player.hand.mask)
+        self.playableCache[player.name] = (self.version, mask)
+        return mask
+
+    def contextFor(self, player):
+        # Context for testing cards from this player's hand
+        self.context.hand = player.hand
+        return self.context
+
+    def dealTo(self, player):
+        card = self.deck.deal()
+        player.hand.addCard(card)
+        return card
+
+    def playerWins(self, player, cards):
+        # Update scores and close out the round
+        player.hand = Hand()
+        self.winner = player
+        for p in self.players:
+            self.roundScores[p.name] = self.STARTING_HAND_SIZE - p.hand.numberOfCards()
+            p.score += self.roundScores[p.name]
+        self.roundActive = False
+        turn = self.endTurn(Turn(player, Outcome.WIN, cards, []))
+        for callback in self.onRoundEnd:
+            callback(self)
+        return turn
+
+    def abandonRound(self):
+        # Ends the round there and then, with no winner and no points scored
+        if not self.roundActive:
+            return
+        self.roundActive = False
+        for callback in self.onRoundEnd:
+            callback(self)
+
+    def endTurn(self, turn):
+        self.turns += 1
+        self.version += 1
+        if self.roundActive:
+            self.player = self.players.nextPlayer()
+        for callback in self.onTurn:
+            callback(self, turn)
+        return turn
+
+    def playRound(self, rule, agents, maxTurns = None):
+        # Plays a whole round with no I/O. agents maps each player's name to an Agent.
+        # Returns the winning Player, or None if maxTurns ran out first.
+        self.startRound(rule)
+        while self.roundActive:
+            if maxTurns is not None and self.turns >= maxTurns:
+                self.abandonRound()
+                return None
+            move = agents[self.player.name].chooseMove(self, self.player)
+            if move == NO_PLAY:
+                self.declareNoPlay()
+            else:
+                self.playCard(move)
+        return self.winner
+
+
+class Agent:
+    # Decides what a player does on their turn. Return a Card from the player's hand, or NO_PLAY.
+    def chooseMove(self, engine, player):
+        raise NotImplementedError
+
+
+class RandomAgent(Agent):
+    # Plays a random card from their hand and never declares NO PLAY
+    def __init__(self, chooser = randomChoice):
+        self.choose = chooser
+
+    def chooseMove(self, engine, player):
+        return self.choose(list(player.hand))
+
+
+class OracleAgent(Agent):
+    # Knows the secret rule: plays a passing card if there is one, otherwise declares NO PLAY
+    def chooseMove(self, engine, player):
+        passing = engine.playable(player)
+        if passing:
+            return Card.fromCode((passing & -passing).bit_length() - 1)
+        return NO_PLAY
@@ -0,0 +1,130 @@
+#  © 2018 Matt Fan
+# http://mattfan.me/
+
+from argparse import ArgumentParser
+from time import perf_counter
+from rules import rules as myRules
+from analysis import analyze, deadEndCount, passProbability, fieldMasks
+
+# Procedurally generated composite rules: every merge/overlay tree over the base rules, up to a
+# number of leaves, screened by their truth tables (see analysis.py) before any Rule is built.
+#
+# A composite's table is its parts' tables ANDed (merge) or ORed (overlay) together, so each
+# candidate costs a couple of whole-table int operations. Candidates with the same table are the
+# same rule however they're written, and only the first (smallest) one is kept. Candidates no card
+# can ever pass, or that leave some MAIN LINE with no passing card at all, are thrown away.
+#
+# Tables cover every possible last card of the MAIN LINE, so only base rules with a window of 0
+# or 1 take part.
+
+
+class Candidate:
+    def __init__(self, table, leaves, rule = None, op = None, left = None, right = None):
+        self.table = table
+        self.leaves = leaves
+        self.rule = rule # the base Rule for a leaf
+        self.op = op # 'and' (merge) or 'or' (overlay) for a composite of left and right
+        self.left = left
+        self.right = right
+        self.deadEnds = deadEndCount(table, 52) # last cards after which nothing passes
+        self.built = None
+
+    def passProbability(self):
+        return passProbability(self.table, 52)
+
+    def name(self):
+        if self.rule is not None:
+            return self.rule.name
+        return f"({self.left.name()} {self.op} {self.right.name()})"
+
+    def build(self):
+        # The composite as a Rule (compiled, like its parts)
+        if self.built is None:
+            if self.rule is not None:
+                self.built = self.rule
+            elif self.op == 'and':
+                self.built = self.left.build().merge(self.right.build())
+            else:
+                self.built = self.left.build().overlay(self.right.build())
+        return self.built
+
+
+class RuleGenerator:
+    def __init__(self, rules = myRules):
+        self.base = [rule for rule in rules if rule.window is not None and rule.window <= 1]
+        self.everything = fieldMasks(52)[0] # the table of a rule every card always passes
+        self.levels = [[]] # levels[n]: distinct candidates with n leaves, dead ends included
+        self.seen = set() # every table so far
+        self.screened = 0
+        self.duplicates = 0
+        self.impossible = 0 # no card ever passes, or every card always does
+        self.deadEnds = 0
+        leaves = []
+        for rule in self.base:
+            candidate = Candidate(analyze(rule).table, 1, rule)
+            if self.admit(candidate):
+                leaves.append(candidate)
+        self.levels.append(leaves)
+
+    def admit(self, candidate):
+        # Records the candidate. Returns True if its table is new and worth combining further.
+        # Candidates with dead ends are kept for that, since an overlay can still fill them in.
+        self.screened += 1
+        table = candidate.table
+        if table in self.seen:
+            self.duplicates += 1
+            return False
+        self.seen.add(table)
+        if not table or table == self.everything:
+            self.impossible += 1
+            return False
+        if candidate.deadEnds:
+            self.deadEnds += 1
+        return True
+
+    def grow(self, leaves):
+        # Builds the level of candidates with this many leaves out of the smaller ones
+        level = []
+        for smaller in range(1, leaves // 2 + 1):
+            lefts, rights = self.levels[smaller], self.levels[leaves - smaller]
+            for i, left in enumerate(lefts):
+                # merge and overlay are symmetric, so equal-sized pairs are only tried one way round
+                for right in (rights[i:] if smaller == leaves - smaller else rights):
+                    for op, table in (('and', left.table & right.table), ('or', left.table | right.table)):
+                        candidate = Candidate(table, leaves, None, op, left, right)
+                        if self.admit(candidate):
+                            level.append(candidate)
+        self.levels.append(level)
+
+    def candidates(self, maxLeaves = 3):
+        # Yields every distinct candidate without dead ends, fewest leaves first
+        for leaves in range(1, maxLeaves + 1):
+            if leaves >= len(self.levels):
+                self.grow(leaves)
+            for candidate in self.levels[leaves]:
+                if not candidate.deadEnds:
+                    yield candidate
+
+    def pool(self, low = .15, high = .35, maxLeaves = 3, size = 20):
+        # The best `size` candidates whose pass probability is within [low, high], closest to the
+        # middle of the band first, then fewest leaves
+        middle = (low + high) / 2
+        band = [c for c in self.candidates(maxLeaves) if low <= c.passProbability() <= high]
+        band.sort(key=lambda c: (abs(c.passProbability() - middle), c.leaves))
+        return band[:size]
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description='Generate composite rules within a difficulty band.')
+    parser.add_argument('--low', type=float, default=.15, help='lowest pass probability to keep')
+    parser.add_argument('--high', type=float, default=.35, help='highest pass probability to keep')
+    parser.add_argument('--leaves', type=int, default=3, help='most base rules in one composite')
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+    start = perf_counter()
+    generator = RuleGenerator()
+    pool = generator.pool(args.low, args.high, args.leaves, args.top)
+    print(f"Screened {generator.screened} candidates in {perf_counter() - start:.2f}s: {generator.duplicates} duplicates, "
+          f"{generator.impossible} impossible, {generator.deadEnds} with dead ends")
+    for candidate in pool:
+        print(f"{candidate.passProbability():.3f}  {candidate.name()}")
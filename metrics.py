@@ -0,0 +1,247 @@
+#  © 2018 Matt Fan
+# http://mattfan.me/
+
+import json
+import sys
+from threading import Thread, Event
+from time import perf_counter_ns, time
+from cardobjects import Hand, Deck
+from eleusisobjects import Rule
+from engine import Engine
+
+# Optional instrumentation of the hot paths: how often each rule is evaluated and how long that
+# takes, Hand.odds and removeAPassingCard timings, cards dealt and deck refolds, and how long the
+# engine takes to play each turn.
+#
+#   import metrics
+#   metrics.enable()
+#   ... play ...
+#   metrics.current.snapshot()      # everything as a dict
+#   metrics.current.dumpText()      # or a readable summary
+#
+# enable() swaps timing wrappers in for the instrumented methods and disable() puts the originals
+# back, so while metrics are off the game runs exactly the code it runs without this module.
+# Timings go into histograms with power-of-two nanosecond buckets.
+# A rule's evaluations are the calls to Rule.test and Rule.acceptMask, plus the engine's calls to
+# Engine.playable, whether those are answered from the engine's memo or by the rule. A playable()
+# call counts once, however the rule gets asked inside it.
+
+
+class Histogram:
+    # Counts of timings by bucket: bucket n holds the timings of n bits, i.e. [2**(n-1), 2**n) ns
+    def __init__(self):
+        self.buckets = [0] * 64
+        self.count = 0
+        self.total = 0
+        self.high = 0
+
+    def add(self, ns):
+        self.buckets[ns.bit_length()] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.high:
+            self.high = ns
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, p):
+        # Upper edge of the bucket the p-th percentile (0 to 100) falls in
+        target = self.count * p / 100
+        seen = 0
+        for n, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return min(1 << n, self.high)
+        return 0
+
+    def toDict(self):
+        return {'count': self.count, 'totalNs': self.total, 'meanNs': round(self.mean()), 'maxNs': self.high,
+                'p50Ns': self.percentile(50), 'p99Ns': self.percentile(99),
+                'buckets': { 1 << n: count for n, count in enumerate(self.buckets) if count }}
+
+
+class Metrics:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time()
+        self.rules = {} # rule name -> Histogram of test() and acceptMask() calls
+        self.timings = {} # 'hand.odds', 'turn.MAIN' etc. -> Histogram
+        self.deals = 0
+        self.refolds = 0
+
+    def timing(self, name):
+        histogram = self.timings.get(name)
+        if histogram is None:
+            histogram = self.timings[name] = Histogram()
+        return histogram
+
+    def ruleEvaluated(self, rule, ns):
+        histogram = self.rules.get(rule.name)
+        if histogram is None:
+            histogram = self.rules[rule.name] = Histogram()
+        histogram.add(ns)
+
+    def snapshot(self):
+        # Copy of everything collected so far, as plain dicts and numbers
+        return {
+            'seconds': time() - self.started,
+            'rules': { name: h.toDict() for name, h in list(self.rules.items()) },
+            'timings': { name: h.toDict() for name, h in list(self.timings.items()) },
+            'deals': self.deals,
+            'refolds': self.refolds,
+        }
+
+    def dumpJSON(self, file = None):
+        text = json.dumps(self.snapshot())
+        if file:
+            file.write(text + '\n')
+        return text
+
+    def dumpText(self, file = None):
+        data = self.snapshot()
+        lines = [f"Metrics over {data['seconds']:.1f}s: {data['deals']} cards dealt, {data['refolds']} refolds"]
+        for title, section in (('Rule evaluations', data['rules']), ('Timings', data['timings'])):
+            lines.append(f"{title}:")
+            for name, h in sorted(section.items(), key=lambda item: -item[1]['totalNs']):
+                name = name if len(name) <= 40 else name[:37] + '...'
+                lines.append(f"    {name:40} {h['count']:>10} calls   mean {h['meanNs']:>9}ns   p99 {h['p99Ns']:>9}ns   max {h['maxNs']:>9}ns")
+        text = '\n'.join(lines)
+        if file:
+            file.write(text + '\n')
+        return text
+
+
+current = Metrics()
+_originals = {}
+_inPlayable = False # set while Engine.playable runs, so the rule calls inside it aren't counted again
+
+
+def _timed(record):
+    # Wraps a method so that record(args, result, ns) is called after every call
+    def wrap(original):
+        def wrapper(*args, **kwargs):
+            start = perf_counter_ns()
+            result = original(*args, **kwargs)
+            record(args, result, perf_counter_ns() - start)
+            return result
+        return wrapper
+    return wrap
+
+
+def _dealt(original):
+    def wrapper(deck):
+        refolds = deck.refolds
+        start = perf_counter_ns()
+        card = original(deck)
+        current.timing('deck.deal').add(perf_counter_ns() - start)
+        current.deals += 1
+        current.refolds += deck.refolds - refolds
+        return card
+    return wrapper
+
+
+def _playable(original):
+    def wrapper(engine, player = None):
+        global _inPlayable
+        _inPlayable = True
+        start = perf_counter_ns()
+        try:
+            return original(engine, player)
+        finally:
+            _inPlayable = False
+            current.ruleEvaluated(engine.rule, perf_counter_ns() - start)
+    return wrapper
+
+
+def _hooks():
+    # (class, method name, wrap(original) -> wrapper) for every instrumented method
+    def rule(args, result, ns):
+        if not _inPlayable:
+            current.ruleEvaluated(args[0], ns)
+
+    def timing(name):
+        return lambda args, result, ns: current.timing(name).add(ns)
+
+    def turn(args, result, ns):
+        current.timing('turn').add(ns)
+        current.timing(f"turn.{result.outcome.name}").add(ns)
+
+    return [
+        (Rule, 'test', _timed(rule)),
+        (Rule, 'acceptMask', _timed(rule)),
+        (Hand, 'odds', _timed(timing('hand.odds'))),
+        (Hand, 'removeAPassingCard', _timed(timing('hand.removeAPassingCard'))),
+        (Deck, 'deal', _dealt),
+        (Engine, 'playable', _playable),
+        (Engine, 'playCard', _timed(turn)),
+        (Engine, 'declareNoPlay', _timed(turn)),
+    ]
+
+
+def enabled():
+    return bool(_originals)
+
+
+def enable(metrics = None):
+    # Starts collecting, into `metrics` if given (it becomes metrics.current)
+    global current
+    if metrics is not None:
+        current = metrics
+    if _originals:
+        return current
+    for cls, name, wrap in _hooks():
+        original = cls.__dict__[name]
+        _originals[(cls, name)] = original
+        setattr(cls, name, wrap(original))
+    return current
+
+
+def disable():
+    for (cls, name), original in _originals.items():
+        setattr(cls, name, original)
+    _originals.clear()
+
+
+class Dumper(Thread):
+    # Writes current metrics to a file (or stdout) every `interval` seconds until stopped.
+    # With a path, each dump replaces the file's contents; otherwise dumps are appended to stdout.
+    def __init__(self, interval = 60, path = None, format = 'text'):
+        Thread.__init__(self, daemon = True)
+        self.interval = interval
+        self.path = path
+        self.format = format
+        self.stopped = Event()
+
+    def dump(self):
+        if self.path:
+            with open(self.path, 'w') as file:
+                self.write(file)
+        else:
+            self.write(sys.stdout)
+            sys.stdout.flush()
+
+    def write(self, file):
+        if self.format == 'json':
+            current.dumpJSON(file)
+        else:
+            current.dumpText(file)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.dump()
+
+
+def startDumping(interval = 60, path = None, format = 'text'):
+    # Enables metrics and dumps them periodically from a background thread. Returns the Dumper.
+    enable()
+    dumper = Dumper(interval, path, format)
+    dumper.start()
+    return dumper
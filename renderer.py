@@ -0,0 +1,66 @@
+#  © 2018 Matt Fan
+# http://mattfan.me/
+
+import sys
+from os import name
+from cardobjects import Card
+
+# Draws the terminal game's screens. Every card's strings are formatted once, up front; only the
+# most recent rows of the line are drawn, with a count of the rest; the screen is cleared with
+# ANSI escape codes rather than a shell; and each screen goes out as a single write. So a turn
+# takes the same time to draw however long the line gets, which matters over a slow connection.
+
+CLEAR = '\x1b[2J\x1b[H' # clear the screen and move the cursor to the top left
+
+# Per card code: the MAIN LINE column (fancyFormat, padded), and the SIDE LINE entry
+_mainColumn = [f"{card.fancyFormat():27}" for card in Card.allCards()]
+_sideEntry = [f" {card.shortFormat()}" for card in Card.allCards()]
+_handEntry = [f"    {card.fancyFormat()}" for card in Card.allCards()]
+
+
+def enableEscapeCodes():
+    # The Windows console only acts on ANSI escape codes once asked to, through the console API
+    if name != 'nt':
+        return
+    import ctypes
+    kernel32 = ctypes.windll.kernel32
+    console = kernel32.GetStdHandle(-11) # STD_OUTPUT_HANDLE
+    mode = ctypes.c_uint32()
+    if kernel32.GetConsoleMode(console, ctypes.byref(mode)):
+        kernel32.SetConsoleMode(console, mode.value | 0x0004) # ENABLE_VIRTUAL_TERMINAL_PROCESSING
+
+
+class Renderer:
+    def __init__(self, out = None, rows = 10):
+        self.out = out if out else sys.stdout
+        self.rows = rows # rows of the line to show. A BoundedLine should keep at least this many.
+        enableEscapeCodes()
+
+    def lineText(self, line):
+        # THE LINE, most recent row at the top, as one string
+        length = len(line.getMainLine())
+        start = max(length - self.rows, 0)
+        parts = [f"   {'MAIN LINE:':27}   SIDE LINE:\n"]
+        for main, side in reversed(list(line.rows(start))):
+            parts.append(f"    {_mainColumn[main.code]}| {''.join(_sideEntry[card.code] for card in side)}\n")
+        if start:
+            parts.append(f"    ... {start} more\n")
+        return ''.join(parts)
+
+    def handText(self, hand):
+        return ''.join(_handEntry[card.code] + '\n' for card in hand)
+
+    def turnText(self, engine, player):
+        # Everything a player sees at the start of their turn
+        counts = ''.join(f"    {p.name}: {p.hand.numberOfCards()}    |" for p in engine.getPlayers())
+        return (f"\n--- It's {player.name}'s Turn! ---\nPlayer Cards:\n    |{counts}\n"
+                f"\nTHE LINE (most recent at top): \n{self.lineText(engine.line)}"
+                f"\nYOUR HAND: \n{self.handText(player.hand)}\n")
+
+    def show(self, text = ''):
+        # Clears the screen and draws text, in one write
+        self.out.write(CLEAR + text)
+        self.out.flush()
+
+    def clear(self):
+        self.show()
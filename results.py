@@ -0,0 +1,114 @@
+#  © 2018 Matt Fan
+# http://mattfan.me/
+
+import sqlite3
+from time import time
+
+# A local SQLite store of rounds: the rule, the winner, how long the round went, and what each
+# player scored, kept across games so leaderboards and per-rule or per-player histories can be
+# looked up later. Rounds that are abandoned (out of turns, or the game was stopped) are kept too,
+# with no winner and no scores.
+#
+#   store = ResultsStore('results.db').attach(engine)
+#   ... play ...
+#   store.leaderboard()
+#   store.close()
+#
+# Rounds are queued in memory and written in batches, each batch one transaction with one
+# executemany per table, so logging a round costs a list append. Queries and close() flush, so
+# use the store as a context manager (or close it in a finally) to keep the last batch.
+# Round ids are handed out here rather than by SQLite, so a store should be the only writer to
+# its database while it's open.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rounds (
+    id INTEGER PRIMARY KEY,
+    rule TEXT NOT NULL,
+    winner TEXT,
+    turns INTEGER NOT NULL,
+    mainLine INTEGER NOT NULL,
+    played REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scores (
+    round INTEGER NOT NULL REFERENCES rounds(id),
+    player TEXT NOT NULL,
+    score INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS roundsByRule ON rounds (rule, turns);
+CREATE INDEX IF NOT EXISTS scoresByPlayer ON scores (player, round, score);
+"""
+
+
+class ResultsStore:
+    def __init__(self, path = ':memory:', batchSize = 1000):
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.executescript(SCHEMA)
+        self.batchSize = batchSize # rounds queued before they're written
+        self.nextId = self.db.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM rounds').fetchone()[0]
+        self.rounds = [] # queued rows for each table
+        self.scores = []
+
+    def record(self, rule, winner, turns, mainLine, scores, played = None):
+        # Queues a round. winner is None for a round nobody won; scores maps player name -> points.
+        roundId = self.nextId
+        self.nextId += 1
+        self.rounds.append((roundId, rule, winner, turns, mainLine, played if played is not None else time()))
+        self.scores.extend((roundId, player, score) for player, score in scores.items())
+        if len(self.rounds) >= self.batchSize:
+            self.flush()
+        return roundId
+
+    def recordRound(self, engine):
+        # Queues the engine's last round. An abandoned round has no winner and no scores.
+        return self.record(engine.rule.name, engine.winner.name if engine.winner else None, engine.turns,
+                           len(engine.line.getMainLine()), engine.roundScores)
+
+    def attach(self, engine):
+        # Records every round the engine finishes or abandons from now on
+        engine.onRoundEnd.append(self.recordRound)
+        return self
+
+    def flush(self):
+        if not self.rounds:
+            return
+        with self.db:
+            self.db.executemany('INSERT INTO rounds VALUES (?, ?, ?, ?, ?, ?)', self.rounds)
+            self.db.executemany('INSERT INTO scores VALUES (?, ?, ?)', self.scores)
+        self.rounds = []
+        self.scores = []
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def leaderboard(self, limit = 10):
+        # [(player, total score, rounds played, rounds won)], highest total first
+        self.flush()
+        return self.db.execute("""
+            SELECT s.player, SUM(s.score), COUNT(*), SUM(r.winner = s.player)
+            FROM scores s JOIN rounds r ON r.id = s.round
+            GROUP BY s.player ORDER BY SUM(s.score) DESC, s.player LIMIT ?""", (limit,)).fetchall()
+
+    def ruleStats(self, rule = None):
+        # [(rule, rounds, rounds won, mean turns, fewest turns, most turns)], for one rule or all of them
+        self.flush()
+        where, args = ('WHERE rule = ?', (rule,)) if rule is not None else ('', ())
+        return self.db.execute(f"""
+            SELECT rule, COUNT(*), COUNT(winner), AVG(turns), MIN(turns), MAX(turns)
+            FROM rounds {where} GROUP BY rule ORDER BY rule""", args).fetchall()
+
+    def playerHistory(self, player, limit = None):
+        # [(round id, rule, winner, turns, score, played)] for the player's rounds, most recent first
+        self.flush()
+        return self.db.execute("""
+            SELECT r.id, r.rule, r.winner, r.turns, s.score, r.played
+            FROM scores s JOIN rounds r ON r.id = s.round
+            WHERE s.player = ? ORDER BY s.round DESC LIMIT ?""", (player, -1 if limit is None else limit)).fetchall()
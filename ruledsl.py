@@ -0,0 +1,238 @@
+#  © 2018 Matt Fan
+# http://mattfan.me/
+
+import operator
+from itertools import count as counter
+from eleusisobjects import Rule
+
+# A small language for writing rules as expressions instead of lambdas, e.g.
+#
+#   from ruledsl import rule, card, prev
+#   rule('Alternate colors', card.color != prev(1).color)
+#
+# Expressions are built from the card being played (card), earlier cards on the MAIN LINE
+# (prev(1) is the last one), Python constants, and:
+#   .color .suit .rank .highRank .value .parity   attributes of a card (parity is rank % 2)
+#   == != < <= > >= + - %                          the usual operators
+#   & | ~                                          and, or, not (Python's own can't be overloaded)
+#   when(condition, then, otherwise)               if-else
+#   x.oneOf(a, b, ...), lookup(dict, key)          membership and table lookups
+#   count(cards, predicate), length(cards)         over mainLine, fullLine or hand; the predicate
+#                                                  is written in terms of `each`
+#   known(k)                                       True once the MAIN LINE has at least k cards
+#
+# An expression compiles to a single lambda, with anything that only involves constants worked
+# out up front. Each expression also knows its footprint: how far back along the MAIN LINE it
+# looks, and whether it needs the full line or the hand. rule() uses it to give the Rule a window,
+# so rules that only look at the last few cards are compiled to lookup tables.
+# prev(k) raises IndexError on a line shorter than k cards, like m[-k] does; guard with known(k).
+
+_names = counter()
+
+
+class Footprint:
+    # What an expression depends on. lookback is how many MAIN LINE cards back it looks, or None
+    # if it can read the whole MAIN LINE.
+    def __init__(self, lookback = 0, usesLine = False, usesHand = False):
+        self.lookback = lookback
+        self.usesLine = usesLine
+        self.usesHand = usesHand
+
+    def __or__(self, other):
+        lookback = None if self.lookback is None or other.lookback is None else max(self.lookback, other.lookback)
+        return Footprint(lookback, self.usesLine or other.usesLine, self.usesHand or other.usesHand)
+
+    def window(self):
+        # Window for a Rule with this footprint, or None if it needs more than the end of the MAIN LINE
+        if self.usesLine or self.usesHand:
+            return None
+        return self.lookback
+
+    def __eq__(self, other):
+        return (self.lookback, self.usesLine, self.usesHand) == (other.lookback, other.usesLine, other.usesHand)
+
+    def __repr__(self):
+        return f"Footprint(lookback={self.lookback}, usesLine={self.usesLine}, usesHand={self.usesHand})"
+
+
+def wrap(x):
+    return x if isinstance(x, Expression) else Constant(x)
+
+
+def _combine(parts, source):
+    footprint = Footprint()
+    constants = {}
+    for part in parts:
+        footprint = footprint | part.footprint
+        constants.update(part.constants)
+    return Expression(source, footprint, constants)
+
+
+class Expression:
+    # Python source over c, m, d and h, plus its footprint and the constants the source refers to
+    __hash__ = object.__hash__
+
+    def __init__(self, source, footprint, constants = None):
+        self.source = source
+        self.footprint = footprint
+        self.constants = constants if constants else {}
+
+    def __bool__(self):
+        raise TypeError("Expressions can't be used as Python booleans; use &, | and ~ instead of and, or and not")
+
+    def _binary(self, other, symbol, op, reflected = False):
+        other = wrap(other)
+        left, right = (other, self) if reflected else (self, other)
+        if isinstance(left, Constant) and isinstance(right, Constant):
+            return Constant(op(left.value, right.value))
+        return _combine((left, right), f"({left.source} {symbol} {right.source})")
+
+    def __eq__(self, other): return self._binary(other, '==', operator.eq)
+    def __ne__(self, other): return self._binary(other, '!=', operator.ne)
+    def __lt__(self, other): return self._binary(other, '<', operator.lt)
+    def __le__(self, other): return self._binary(other, '<=', operator.le)
+    def __gt__(self, other): return self._binary(other, '>', operator.gt)
+    def __ge__(self, other): return self._binary(other, '>=', operator.ge)
+    def __add__(self, other): return self._binary(other, '+', operator.add)
+    def __radd__(self, other): return self._binary(other, '+', operator.add, True)
+    def __sub__(self, other): return self._binary(other, '-', operator.sub)
+    def __rsub__(self, other): return self._binary(other, '-', operator.sub, True)
+    def __mod__(self, other): return self._binary(other, '%', operator.mod)
+
+    def __and__(self, other):
+        other = wrap(other)
+        if isinstance(self, Constant):
+            return other if self.value else self
+        if isinstance(other, Constant):
+            return self if other.value else other
+        return _combine((self, other), f"({self.source} and {other.source})")
+
+    def __or__(self, other):
+        other = wrap(other)
+        if isinstance(self, Constant):
+            return self if self.value else other
+        if isinstance(other, Constant):
+            return other if other.value else self
+        return _combine((self, other), f"({self.source} or {other.source})")
+
+    def __rand__(self, other):
+        return wrap(other) & self
+
+    def __ror__(self, other):
+        return wrap(other) | self
+
+    def __invert__(self):
+        return _combine((self,), f"(not {self.source})")
+
+    def oneOf(self, *values):
+        # Constants are looked up in one frozenset; anything else is compared with ==, so its
+        # footprint becomes part of the result's
+        values = [wrap(value) for value in values]
+        constants = frozenset(value.value for value in values if isinstance(value, Constant))
+        result = self._binary(constants, 'in', lambda a, b: a in b) if constants else Constant(False)
+        for value in values:
+            if not isinstance(value, Constant):
+                result = result | (self == value)
+        return result
+
+    # Card attributes. Only meaningful on expressions that stand for a card.
+    def attribute(self, name):
+        return Expression(f"{self.source}.{name}", self.footprint, self.constants)
+
+    color = property(lambda self: self.attribute('color'))
+    suit = property(lambda self: self.attribute('suit'))
+    rank = property(lambda self: self.attribute('rank'))
+    highRank = property(lambda self: self.attribute('highRank'))
+    value = property(lambda self: self.attribute('value'))
+    parity = property(lambda self: self.rank % 2)
+
+
+class Constant(Expression):
+    def __init__(self, value):
+        if value is None or type(value) in (bool, int):
+            Expression.__init__(self, repr(value), Footprint())
+        else:
+            name = f"_k{next(_names)}"
+            Expression.__init__(self, name, Footprint(), { name: value })
+        self.constantValue = value
+
+    # Constant's own value shadows the card attribute `value`
+    value = property(lambda self: self.constantValue)
+
+    def attribute(self, name):
+        return Constant(getattr(self.constantValue, name))
+
+    def __invert__(self):
+        return Constant(not self.constantValue)
+
+
+class Cards:
+    # A collection of cards a rule can count over
+    def __init__(self, source, footprint):
+        self.source = source
+        self.footprint = footprint
+
+
+card = Expression('c', Footprint())
+each = Expression('x', Footprint()) # the card being looked at inside count()
+mainLine = Cards('m', Footprint(lookback = None))
+fullLine = Cards('d', Footprint(usesLine = True))
+hand = Cards('h', Footprint(usesHand = True))
+
+
+def prev(k = 1):
+    # The k-th most recent card on the MAIN LINE
+    if k < 1:
+        raise ValueError('prev() counts back from 1, the last card on the MAIN LINE')
+    return Expression(f"m[-{k}]", Footprint(lookback = k))
+
+
+def known(k):
+    return Expression(f"(len(m) >= {k})", Footprint(lookback = k))
+
+
+def when(condition, then, otherwise):
+    condition, then, otherwise = wrap(condition), wrap(then), wrap(otherwise)
+    if isinstance(condition, Constant):
+        return then if condition.value else otherwise
+    return _combine((condition, then, otherwise), f"({then.source} if {condition.source} else {otherwise.source})")
+
+
+def lookup(mapping, key):
+    key = wrap(key)
+    if isinstance(key, Constant):
+        return Constant(mapping[key.value])
+    table = Constant(dict(mapping))
+    return _combine((table, key), f"{table.source}[{key.source}]")
+
+
+def count(cards, predicate = True):
+    # Number of cards in the collection for which predicate (an expression in `each`) holds
+    predicate = wrap(predicate)
+    if isinstance(predicate, Constant):
+        if not predicate.value:
+            return Constant(0)
+        expression = Expression(f"len({cards.source})", cards.footprint)
+    else:
+        expression = Expression(f"sum(1 for x in {cards.source} if {predicate.source})",
+                                cards.footprint | predicate.footprint, predicate.constants)
+    return expression
+
+
+def length(cards):
+    return count(cards)
+
+
+def compileExpression(expression):
+    # Returns the expression as a function of (c, m, d, h)
+    expression = wrap(expression)
+    return eval(f"lambda c, m, d, h: {expression.source}", dict(expression.constants))
+
+
+def rule(name, expression):
+    # Builds a Rule, compiled to a lookup table if the expression only looks at the end of the MAIN LINE
+    expression = wrap(expression)
+    built = Rule(name, compileExpression(expression), expression.footprint.window())
+    built.footprint = expression.footprint
+    built.source = expression.source
+    return built
@@ -15,20 +15,21 @@ from functools import reduce
 # d is the entire line, as a List of Dictionaries [{'main': Card, 'side':[Card]}]
 # h is the player's current Hand
 
+# If a rule only looks at the card played and the last few cards of the MAIN LINE, say how many with
+# window=n. The rule is then compiled to a lookup table and never has to run its function during play.
+
+# Cards carry precomputed attributes, so rules don't have to work anything out per call:
+# c.rank is 1-13 (ace low), c.highRank is 2-14 (ace high) and c.color is a Color.
+# m.stats holds running totals for the whole line (see LineStats in eleusisobjects.py): counts per
+# suit, color and rank on the MAIN and SIDE LINE, the current color/suit/parity run on the MAIN LINE,
+# and where each rank was last played. Use them instead of walking back through m or d.
+
 # Some helper functions. To add your own rules, scroll down to the 'rules' list
+nextSuit = { Suit.SPADE: Suit.HEART, Suit.HEART: Suit.DIAMOND, Suit.DIAMOND: Suit.CLUB, Suit.CLUB: Suit.SPADE }
+
 def threeInARow(c, m, d, h):
-    colorCount = 0
-    color = None
-    for i in range(1,3 +1):
-        try:
-            if color == None:
-                color = m[-i].suit.color()
-            elif color != m[-i].suit.color():
-                break
-            colorCount += 1
-        except:
-            break
-    return c.suit.color() != color if colorCount == 3 else c.suit.color() == color
+    # Switch colors once the last three MAIN LINE cards share one, otherwise keep the color going
+    return c.color != m[-1].color if m.stats.colorRun >= 3 else c.color == m[-1].color
 
 # I've written some basic rules to start.
 # To add your own, simply add the rule to the rules array below.
@@ -38,41 +39,50 @@ rules = [
     # 'Samples of easy secret rules:'
     Rule(
         'If the last card on the MAINLINE was red, play a black card. If the last card on the MAINLINE was black, play a red card.',
-        lambda c, m, d, h: m[-1].suit.color() != c.suit.color()
+        lambda c, m, d, h: m[-1].color != c.color,
+        window=1
     ),
     Rule(
         'If the last card on THE MAINLINE was a spade, play a heart; if it was a heart, play a diamond; if it was diamond, play club; and if it was club, play a spade.',
-        lambda c, m, d, h: { Suit.SPADE: Suit.HEART, Suit.HEART: Suit.DIAMOND, Suit.DIAMOND: Suit.CLUB, Suit.CLUB: Suit.SPADE }[m[-1].suit] == c.suit
+        lambda c, m, d, h: nextSuit[m[-1].suit] == c.suit,
+        window=1
     ),
     Rule(
         'The cards on the MAINLINE must follow this pattern: three red cards, then three black, then three red, then three black, etc.',
-        threeInARow
+        threeInARow,
+        window=3
     ),
     Rule(
         'If the last card is an odd-numbered card, play an even-numbered card; if the last is even, play an odd. [When numbers are involved, ace is usually 1 (odd), jack is 11 (odd), queen is 12 (even), and king is 13 (odd).',
-        lambda c, m, d, h: c.valAsNum() % 2 != m[-1].valAsNum() % 2
+        lambda c, m, d, h: c.rank % 2 != m[-1].rank % 2,
+        window=1
     ),
     Rule(
         'If the last card on the MAINLINE is among the cards ace to 7, play a card 8 to king. If it is among 8 to king, play ace to 7.',
-        lambda c, m, d, h: (m[-1].valAsNum() <= 7 and c.valAsNum() > 7) or (m[-1].valAsNum() >= 8 and c.valAsNum() < 8)
+        lambda c, m, d, h: (m[-1].rank <= 7 and c.rank > 7) or (m[-1].rank >= 8 and c.rank < 8),
+        window=1
     ),
     Rule(
         'Play a card with a number that is 1, 2, or 3 higher than the number of the last card on the MAINLINE. The numbers can “turn-the-corner.”',
-        lambda c, m, d, h: 1 <= c.valAsNum() - m[-1].valAsNum() <= 3 or -12 <= c.valAsNum() - m[-1].valAsNum() <= -10
+        lambda c, m, d, h: 1 <= c.rank - m[-1].rank <= 3 or -12 <= c.rank - m[-1].rank <= -10,
+        window=1
     ),
     
     # 'Samples of hard secret rules:'
     Rule(
         'If the last card on the MAINLINE is an odd-numbered card, play a red card. If the last card is even, play a black card.',
-        lambda c, m, d, h: c.suit.color() == Color.RED if m[-1].valAsNum() % 2 == 1 else c.suit.color() == Color.BLACK
+        lambda c, m, d, h: c.color == Color.RED if m[-1].rank % 2 == 1 else c.color == Color.BLACK,
+        window=1
     ),
     Rule(
         'The card played must be the same suit or the same number as the last card on the MAINLINE.',
-        lambda c, m, d, h: c.suit == m[-1].suit or c.valAsNum() == m[-1].valAsNum()
+        lambda c, m, d, h: c.suit == m[-1].suit or c.rank == m[-1].rank,
+        window=1
     ),
     Rule(
         'If the last card on the MAINLINE is black, play a card with a number that is equal to or lower than the number of the last card. If the last card on the MAINLINE is red, play a card equal to or higher than the last card.',
-        lambda c, m, d, h: c.valAsNum() <= m[-1].valAsNum() if m[-1].suit.color() == Color.BLACK else c.valAsNum() >= m[-1].valAsNum()
+        lambda c, m, d, h: c.rank <= m[-1].rank if m[-1].color == Color.BLACK else c.rank >= m[-1].rank,
+        window=1
     )
 
 ]
@@ -0,0 +1,230 @@
+#  © 2018 Matt Fan
+# http://mattfan.me/
+
+import asyncio
+import json
+from argparse import ArgumentParser
+from random import Random
+from rules import rules as myRules
+from cardobjects import Card, CardParseError
+from engine import Engine, IllegalMove
+import metrics
+
+# Hosts any number of concurrent games ("rooms") in one process on asyncio, without a thread per
+# player. Clients speak line-delimited JSON over TCP or a Unix socket; every message is one JSON
+# object on its own line, and cards are sent in the compact format ("AH", "10C").
+#
+# Client -> server:
+#   {"type": "join", "room": "r1", "name": "alice"}   take a seat (rooms are created on demand)
+#   {"type": "start"}                                  start a round with everyone seated
+#   {"type": "play", "card": "QS"}                     play a card on your turn
+#   {"type": "noplay"}                                 declare NO PLAY on your turn
+#   {"type": "leave"}
+#
+# Server -> client:
+#   {"type": "joined", "room": ..., "players": [...]}
+#   {"type": "round", "players": [...], "start": card}
+#   {"type": "turn", "player": name, "timeout": seconds}     to everyone; the player whose turn
+#                                                            it is also gets "hand": [cards]
+#   {"type": "result", "player": name, "outcome": "MAIN" | "SIDE" | "PENALTY" | "NO_PLAY" | "WIN",
+#    "cards": [...], "timedOut": bool}
+#   {"type": "won", "winner": name, "rule": description, "scores": {name: score}}
+#   {"type": "error", "message": ...}
+#
+# A player who doesn't move before the turn timeout, or who has disconnected, is taken to have
+# declared NO PLAY. If everyone leaves, the round is abandoned and the room closed.
+
+
+def cardList(cards):
+    return [card.compactFormat() for card in cards]
+
+
+class Room:
+    def __init__(self, name, server):
+        self.name = name
+        self.server = server
+        self.seats = {} # player name -> writer, in the order they sat down
+        self.moves = asyncio.Queue() # (player name, message) from anyone in the room
+        self.engine = None
+        self.task = None
+
+    def playing(self):
+        return self.task is not None and not self.task.done()
+
+    def send(self, name, message):
+        writer = self.seats.get(name)
+        if writer is not None and not writer.is_closing():
+            writer.write(json.dumps(message).encode() + b'\n')
+
+    def broadcast(self, message):
+        for name in self.seats:
+            self.send(name, message)
+
+    def join(self, name, writer):
+        if self.playing():
+            raise ValueError('A round is already in progress in this room')
+        if name in self.seats:
+            raise ValueError('Sorry, that name is already taken.')
+        self.seats[name] = writer
+        self.broadcast({'type': 'joined', 'room': self.name, 'players': list(self.seats)})
+        if self.server.seats and len(self.seats) >= self.server.seats:
+            self.start()
+
+    def leave(self, name):
+        self.seats.pop(name, None)
+        if self.playing():
+            self.moves.put_nowait((name, {'type': 'leave'})) # wake the round up if it's waiting on them
+
+    def start(self):
+        if self.playing():
+            raise ValueError('A round is already in progress in this room')
+        if len(self.seats) < 2:
+            raise ValueError('At least two players are needed to start')
+        if self.engine is None or [p.name for p in self.engine.getPlayers()] != list(self.seats):
+            self.engine = Engine(list(self.seats), self.server.options, Random(self.server.rng.random()))
+        self.task = asyncio.ensure_future(self.playRound(self.server.rng.choice(self.server.rules)))
+
+    async def playRound(self, rule):
+        engine = self.engine
+        self.moves = asyncio.Queue() # drop anything left over from the last round
+        engine.startRound(rule)
+        self.broadcast({'type': 'round', 'players': list(self.seats), 'start': engine.line.getMainLine()[-1].compactFormat()})
+        try:
+            while engine.roundActive:
+                if not self.seats:
+                    # Everyone has left. Playing on would run every remaining turn as a NO PLAY
+                    # without ever yielding to the other rooms.
+                    engine.abandonRound()
+                    return
+                player = engine.currentPlayer()
+                message = {'type': 'turn', 'player': player.name, 'timeout': self.server.turnTimeout}
+                for name in self.seats:
+                    if name == player.name:
+                        self.send(name, dict(message, hand=cardList(player.hand)))
+                    else:
+                        self.send(name, message)
+                turn, timedOut = await self.nextMove(player)
+                self.broadcast({'type': 'result', 'player': player.name, 'outcome': turn.outcome.name,
+                                'cards': cardList(turn.cards), 'timedOut': timedOut})
+            self.broadcast({'type': 'won', 'winner': engine.winner.name, 'rule': rule.name,
+                            'scores': {p.name: p.score for p in engine.getPlayers()}})
+            self.server.roundsPlayed += 1
+        finally:
+            if not self.seats and self.server.rooms.get(self.name) is self:
+                self.server.rooms.pop(self.name) # the last player left while the round was on
+
+    async def nextMove(self, player):
+        # Waits for the current player's move. Returns (Turn, timedOut).
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.server.turnTimeout
+        while True:
+            if player.name not in self.seats:
+                return self.engine.declareNoPlay(), True
+            try:
+                name, message = await asyncio.wait_for(self.moves.get(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                return self.engine.declareNoPlay(), True
+            if name != player.name:
+                if message['type'] != 'leave':
+                    self.send(name, {'type': 'error', 'message': "It isn't your turn"})
+                continue
+            try:
+                if message['type'] == 'noplay':
+                    return self.engine.declareNoPlay(), False
+                if message['type'] == 'play':
+                    return self.engine.playCard(Card.parse(message.get('card'))), False
+            except (CardParseError, IllegalMove) as error:
+                self.send(name, {'type': 'error', 'message': str(error)})
+
+
+class Server:
+    def __init__(self, rules = myRules, turnTimeout = 30, seats = 0, options = {}, seed = None):
+        self.rules = rules
+        self.turnTimeout = turnTimeout
+        self.seats = seats # start a round as soon as a room has this many players (0: wait for "start")
+        self.options = options # passed on to each room's Engine
+        self.rng = Random(seed)
+        self.rooms = {}
+        self.roundsPlayed = 0
+
+    async def handle(self, reader, writer):
+        # One connection, one seat
+        room = None
+        name = None
+        try:
+            while True:
+                data = await reader.readline()
+                if not data:
+                    break
+                try:
+                    message = json.loads(data)
+                    kind = message['type']
+                except (ValueError, KeyError, TypeError):
+                    self.reply(writer, {'type': 'error', 'message': 'Expected a JSON object with a "type"'})
+                    continue
+                try:
+                    if kind == 'join':
+                        if room is not None:
+                            raise ValueError('Already in a room')
+                        if not isinstance(message.get('room'), str) or not isinstance(message.get('name'), str):
+                            raise ValueError('Expected a "room" and a "name", both strings')
+                        candidate = self.rooms.get(message['room']) or Room(message['room'], self)
+                        candidate.join(message['name'], writer)
+                        room, name = candidate, message['name']
+                        self.rooms[room.name] = room
+                    elif room is None:
+                        raise ValueError('Join a room first')
+                    elif kind == 'start':
+                        room.start()
+                    elif kind in ('play', 'noplay'):
+                        room.moves.put_nowait((name, message))
+                    elif kind == 'leave':
+                        break
+                    else:
+                        raise ValueError(f"Unknown message type '{kind}'")
+                except (ValueError, KeyError) as error:
+                    self.reply(writer, {'type': 'error', 'message': str(error)})
+        except ConnectionError:
+            pass
+        finally:
+            if room is not None:
+                room.leave(name)
+                if not room.seats and not room.playing():
+                    self.rooms.pop(room.name, None)
+            writer.close()
+
+    def reply(self, writer, message):
+        writer.write(json.dumps(message).encode() + b'\n')
+
+    async def listen(self, host = '127.0.0.1', port = 8765, path = None, backlog = 1024):
+        # Starts listening on a Unix socket if a path is given, TCP otherwise. Returns the asyncio server.
+        # backlog is how many connections can wait to be accepted; asyncio's default of 100 turns
+        # away clients when a few dozen rooms' worth connect at once.
+        if path:
+            return await asyncio.start_unix_server(self.handle, path, backlog = backlog)
+        return await asyncio.start_server(self.handle, host, port, backlog = backlog)
+
+
+async def main(args):
+    if args.metrics_interval:
+        metrics.startDumping(args.metrics_interval, args.metrics_file, args.metrics_format)
+    server = Server(turnTimeout = args.timeout, seats = args.seats, options = {'starting_hand_size': args.hand_size})
+    listener = await server.listen(args.host, args.port, args.unix, args.backlog)
+    print(f"Eleusis server listening on {args.unix or f'{args.host}:{args.port}'}")
+    async with listener:
+        await listener.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description='Host Eleusis rooms over line-delimited JSON.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='listen on this Unix socket path instead of TCP')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds per turn')
+    parser.add_argument('--seats', type=int, default=0, help='start rounds automatically once a room has this many players')
+    parser.add_argument('--hand-size', type=int, default=12)
+    parser.add_argument('--backlog', type=int, default=1024, help='connections that can wait to be accepted')
+    parser.add_argument('--metrics-interval', type=float, default=0, help='collect metrics and dump them every this many seconds')
+    parser.add_argument('--metrics-file', help='file to write metrics dumps to (default: stdout)')
+    parser.add_argument('--metrics-format', choices=['text', 'json'], default='text')
+    asyncio.run(main(parser.parse_args()))
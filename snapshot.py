@@ -0,0 +1,133 @@
+#  © 2018 Matt Fan
+# http://mattfan.me/
+
+from cardobjects import Card, Hand, Deck
+from engine import Engine
+from rules import rules as myRules
+
+# Saves and restores the whole state of an Engine as a few hundred bytes: players and scores,
+# whose turn it is, every hand, the cards left in the deck, the line and the active rule.
+# Rules are lambdas and can't be serialized, so the rule is stored as its index in a registry
+# (rules.py by default), and only registered rules can be snapshotted.
+#
+# Layout: a version byte, then unsigned LEB128 varints (scores are zigzag encoded first) and
+# single-byte card codes. Cards are stored as codes with a varint count in front.
+# The deck's remaining cards are saved, but not its random stream: a restored engine deals
+# the same cards in a fresh random order, from the rng passed to restore().
+
+VERSION = 1
+
+
+def writeVarint(out, n):
+    while n > 0x7F:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def writeCards(out, codes):
+    writeVarint(out, len(codes))
+    out.extend(codes)
+
+
+class Reader:
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def byte(self):
+        if self.position >= len(self.data):
+            raise ValueError('truncated snapshot')
+        self.position += 1
+        return self.data[self.position - 1]
+
+    def varint(self):
+        n = shift = 0
+        while True:
+            b = self.byte()
+            n |= (b & 0x7F) << shift
+            if b < 0x80:
+                return n
+            shift += 7
+
+    def bytes(self, size):
+        self.position += size
+        if self.position > len(self.data):
+            raise ValueError('truncated snapshot')
+        return self.data[self.position - size:self.position]
+
+    def cards(self):
+        return self.bytes(self.varint())
+
+
+def snapshot(engine, registry = myRules):
+    # Returns the engine's state as bytes
+    out = bytearray([VERSION])
+    players = list(engine.getPlayers())
+    started = engine.rule is not None
+    if started:
+        ruleIndex = next((i for i, rule in enumerate(registry) if rule is engine.rule), None)
+        if ruleIndex is None:
+            raise ValueError(f"'{engine.rule.name}' isn't in the rule registry, so it can't be saved")
+    writeVarint(out, engine.STARTING_HAND_SIZE)
+    writeVarint(out, len(players))
+    for player in players:
+        name = player.name.encode()
+        writeVarint(out, len(name))
+        out.extend(name)
+        writeVarint(out, player.score * 2 if player.score >= 0 else -player.score * 2 - 1)
+    writeVarint(out, engine.players.turn + 1)
+    if not started:
+        out.append(0)
+        return bytes(out)
+    out.append(1 | (2 if engine.roundActive else 0))
+    writeVarint(out, ruleIndex)
+    writeVarint(out, engine.turns)
+    writeVarint(out, players.index(engine.winner) + 1 if engine.winner else 0)
+    for player in players:
+        writeCards(out, bytes(card.code for card in player.hand))
+    writeCards(out, engine.deck.codes)
+    writeVarint(out, len(engine.line.getMainLine()))
+    for main, side in engine.line.rows():
+        out.append(main.code)
+        writeCards(out, bytes(card.code for card in side))
+    return bytes(out)
+
+
+def restore(data, registry = myRules, rng = None, options = {}):
+    # Rebuilds an Engine from snapshot() output. Callbacks (onTurn etc.) aren't part of the snapshot.
+    reader = Reader(data)
+    if reader.byte() != VERSION:
+        raise ValueError('Unknown snapshot version')
+    handSize = reader.varint()
+    names, scores = [], []
+    for n in range(reader.varint()):
+        names.append(reader.bytes(reader.varint()).decode())
+        score = reader.varint()
+        scores.append(score // 2 if score % 2 == 0 else -(score + 1) // 2)
+    engine = Engine(names, dict(options, starting_hand_size = handSize), rng)
+    players = list(engine.getPlayers())
+    for player, score in zip(players, scores):
+        player.score = score
+    engine.players.turn = reader.varint() - 1
+    flags = reader.byte()
+    if not flags & 1:
+        return engine
+    engine.rule = registry[reader.varint()]
+    engine.roundActive = bool(flags & 2)
+    engine.turns = reader.varint()
+    winner = reader.varint()
+    engine.winner = players[winner - 1] if winner else None
+    for player in players:
+        player.hand = Hand([Card.fromCode(code) for code in reader.cards()])
+    engine.deck = Deck(0, engine.rng)
+    engine.deck.codes.extend(reader.cards())
+    engine.line = engine.newLine(engine.rule)
+    for n in range(reader.varint()):
+        engine.line.addToMain(Card.fromCode(reader.byte()))
+        for code in reader.cards():
+            engine.line.addToSide(Card.fromCode(code))
+    engine.context.line = engine.line
+    if engine.players.turn >= 0:
+        engine.player = players[engine.players.turn]
+    return engine
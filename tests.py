@@ -3,12 +3,36 @@
 
 # Fun Fact: I built a writing habits website that reached #3 on Product Hunt's Product of the Day (https://www.producthunt.com/posts/writedaily)
 
-from cardobjects import Card, Color, Suit, Hand, Deck
-from eleusisobjects import Rule, Line, Players, Player
+from cardobjects import Card, Color, Suit, Hand, Deck, CardParseError, codesIn
+from eleusisobjects import Rule, Line, BoundedLine, Players, Player, Context, VerdictCache
 from rules import rules as myRules
 from eleusis import *
+from engine import Engine, Outcome, IllegalMove, RandomAgent, OracleAgent, NO_PLAY
+from tournament import runTournament, Stats
+from analysis import analyze, tabulate, stateLine
+from server import Server
+from turnlog import TurnLog, replay
+from results import ResultsStore
+from snapshot import snapshot, restore
+from benchmarks import runBenchmarks, compare
+import metrics
+from renderer import Renderer, CLEAR
+from generator import RuleGenerator
+from bot import HypothesisSpace, InferenceAgent
+import ruledsl
+from ruledsl import card, prev, each, when, lookup, count, length, known, mainLine, fullLine, hand, Constant, Footprint
+from rules import nextSuit
+from client import runClient, simulate
 import unittest
+import unittest.mock
+import random
+import asyncio
+import tempfile
+import os
 import itertools
+import json
+import io
+import contextlib
 from functools import reduce
 
 class TestCard(unittest.TestCase):
@@ -53,7 +77,8 @@ class TestCard(unittest.TestCase):
         # As such, strictness won't be tested, only validity on well-formed strings
         self.assertTrue(Card('A', Suit.HEART) == Card.parse('Ace of Hearts'))
         self.assertFalse(Card('A', Suit.HEART) == Card.parse('Ace of Spades'))
-        self.assertTrue(None == Card.parse('Mumbo Jumbo'))
+        with self.assertRaises(CardParseError):
+            Card.parse('Mumbo Jumbo')
         self.assertTrue(Card(3, Suit.SPADE) == Card.parse('Three of Spades'))
         self.assertTrue(Card('K', Suit.DIAMOND) == Card.parse('King of Diamonds'))
         self.assertTrue(Card(4, Suit.CLUB) == Card.parse('Four of Clubs'))
@@ -63,6 +88,31 @@ class TestCard(unittest.TestCase):
         self.assertTrue(Card(3, Suit.SPADE) == Card.parse('three OF spades'))
         self.assertTrue(Card(3, Suit.SPADE) == Card.parse('three of spades'))
         self.assertTrue(Card('K', Suit.DIAMOND) == Card.parse('King of Diamonds   '))
+    def test_parse_formats(self):
+        self.assertTrue(Card.parse('(A♥)') is self.ace) # the short format it prints
+        self.assertTrue(Card.parse(self.ten.shortFormat()) is self.ten)
+        self.assertTrue(Card.parse('10C') is self.ten and Card.parse('tc') is self.ten)
+        self.assertTrue(all(Card.parse(card.compactFormat()) is card for card in Card.allCards()))
+        self.assertTrue(Card.parseMany('(A♥) Ace of Hearts | 2S, kd') == [self.ace, self.ace, self.two, self.king])
+        self.assertTrue(Card.parseMany(['AH', 'Two of Spades']) == [self.ace, self.two])
+        with self.assertRaises(CardParseError) as caught:
+            Card.parseMany('AH, ZZ')
+        self.assertTrue(caught.exception.position == 4)
+        with self.assertRaises(CardParseError) as caught:
+            Card.parseMany(['AH', 'ZZ'])
+        self.assertTrue(caught.exception.position == 1)
+    def test_flyweight(self):
+        self.assertTrue(Card('Q', Suit.CLUB) is Card('Q', Suit.CLUB)) # cards are shared instances
+        self.assertTrue(Card(3, Suit.DIAMOND) is Card('3', Suit.DIAMOND))
+        self.assertTrue(Card.parse('Ace of Hearts') is self.ace)
+        self.assertTrue(len(set(Card.allCards())) == 52)
+        self.assertTrue(all(Card.fromCode(card.code) is card for card in Card.allCards()))
+        self.assertTrue(self.ace.rank == 1 and self.ace.highRank == 14 and self.ace.color == Color.RED)
+        self.assertTrue(self.king.valAsNum() == 13 and self.two.color == Color.BLACK)
+        with self.assertRaises(AttributeError):
+            self.ace.value = 'K'
+        with self.assertRaises(ValueError):
+            Card(11, Suit.HEART)
 
 class TestPlayer(unittest.TestCase):
     pass
@@ -102,8 +152,43 @@ class TestHand(unittest.TestCase):
         self.assertTrue(h2.removeAPassingCard(hasHeart) == None)
 
 
+    def testHandMask(self):
+        h = Hand([Card(9, Suit.HEART), Card(2, Suit.CLUB), Card(9, Suit.HEART)])
+        self.assertTrue(h.count(Card(9, Suit.HEART)) == 2)
+        self.assertTrue(h.mask == 1 << Card(9, Suit.HEART).code | 1 << Card(2, Suit.CLUB).code)
+        pairs = [(a, b) for a in h for b in h] # nested iteration works
+        self.assertTrue(len(pairs) == 9)
+        line = Line()
+        line.addToMain(Card('K', Suit.SPADE))
+        context = Context(line, h)
+        alternate = myRules[0]
+        self.assertTrue(h.passingMask(alternate, context) == 1 << Card(9, Suit.HEART).code)
+        self.assertTrue(h.odds(alternate, context) == 2/3)
+        self.assertTrue(h.removeAPassingCard(alternate, context) == Card(9, Suit.HEART))
+        self.assertTrue(h.hasPassingCard(alternate, context))
+        h.removeCard(Card(9, Suit.HEART))
+        self.assertFalse(h.hasPassingCard(alternate, context))
+        self.assertTrue(h.removeCard(Card(9, Suit.HEART)) is None and len(h) == 1)
+
+
 class TestDeck(unittest.TestCase):
-    pass
+    def testDeal(self):
+        deck = Deck(2, seed = 3)
+        self.assertTrue(len(deck) == 104)
+        dealt = [deck.deal() for n in range(104)]
+        self.assertTrue(sorted(card.code for card in dealt) == sorted(list(range(52)) * 2))
+        same = Deck(2, seed = 3)
+        self.assertTrue(dealt == [same.deal() for n in range(104)]) # seeded decks deal the same cards
+        self.assertTrue(len(deck) == 0)
+
+    def testRefold(self):
+        deck = Deck(1, seed = 1)
+        refolds = []
+        deck.onRefold.append(refolds.append)
+        for n in range(53):
+            deck.deal()
+        self.assertTrue(refolds == [deck] and deck.refolds == 1)
+        self.assertTrue(len(deck) == 51)
 
 class TestLine(unittest.TestCase):
     def testLineBasics(self):
@@ -119,6 +204,91 @@ class TestLine(unittest.TestCase):
         self.assertTrue(line.getFullLine()[0] == Card('Q', Suit.CLUB))
         self.assertTrue(line.getMainLine()[0] == Card('Q', Suit.CLUB))
 
+    def testLineViews(self):
+        line = Line()
+        main = line.getMainLine()
+        full = line.getFullLine()
+        line.addToMain(Card(2, Suit.HEART))
+        line.addToSide(Card(4, Suit.CLUB))
+        line.addToMain(Card(6, Suit.SPADE))
+        self.assertTrue(main == [Card(2, Suit.HEART), Card(6, Suit.SPADE)]) # views follow the line as it grows
+        self.assertTrue(full == [Card(2, Suit.HEART), Card(4, Suit.CLUB), Card(6, Suit.SPADE)])
+        self.assertTrue(len(full) == 3)
+        with self.assertRaises(TypeError): # views are read-only
+            main[0] = Card(3, Suit.HEART)
+
+    def testBoundedLine(self):
+        with tempfile.TemporaryDirectory() as directory:
+            plain, bounded = Line(), BoundedLine(3, os.path.join(directory, 'line.spill'))
+            deck = Deck(3, random.Random(2))
+            rng = random.Random(3)
+            for n in range(150):
+                card, main = deck.deal(), n == 0 or rng.random() < .6
+                for line in (plain, bounded):
+                    line.addToMain(card) if main else line.addToSide(card)
+            self.assertTrue(len(bounded.recent) == 3 and bounded.spilledMain > 0)
+            for name in ('getMainLine', 'getFullLine'):
+                mine, theirs = getattr(plain, name)(), getattr(bounded, name)()
+                self.assertTrue(len(mine) == len(theirs) and list(mine) == list(theirs) and theirs == mine)
+                for index in [0, 1, 7, len(mine) // 2, -4, -3, -2, -1]:
+                    self.assertTrue(mine[index] == theirs[index])
+                self.assertTrue(list(mine[-3:]) == theirs[-3:] and list(mine[:5]) == theirs[:5])
+                with self.assertRaises(IndexError):
+                    theirs[len(mine)]
+            for start in [0, 1, bounded.spilledMain - 1, bounded.spilledMain, len(plain.getMainLine()) - 1]:
+                self.assertTrue(list(plain.rows(start)) == list(bounded.rows(start)))
+            bounded.close()
+
+    def testBoundedLineCheckpoints(self):
+        plain, bounded = Line(), BoundedLine(2)
+        deck = Deck(40, random.Random(4))
+        rng = random.Random(5)
+        for n in range(2000):
+            card, main = deck.deal(), n == 0 or rng.random() < .7
+            for line in (plain, bounded):
+                line.addToMain(card) if main else line.addToSide(card)
+        self.assertTrue(len(bounded.checkpoints) > 3 and bounded.line == plain.line)
+        reads = []
+        spilled = bounded.spilled
+        bounded.spilled = lambda start = 0, chunkSize = 1 << 16: reads.append(start) or spilled(start, chunkSize)
+        for start in [0, 255, 256, 257, 1000, bounded.spilledMain - 1, bounded.spilledMain]:
+            self.assertTrue(list(plain.rows(start)) == list(bounded.rows(start)))
+            self.assertTrue(plain.getMainLine()[start] == bounded.getMainLine()[start])
+        # every read starts at the checkpoint before the row asked for, not at the top of the file
+        starts = [0, 255, 256, 257, 1000, bounded.spilledMain - 1]
+        self.assertTrue(reads == [bounded.checkpoints[start // 256] for start in starts for n in range(2)])
+        bounded.close()
+
+    def testLineStats(self):
+        for line in (Line(), BoundedLine(2)):
+            for card in [Card(2, Suit.HEART), Card(4, Suit.HEART), Card('Q', Suit.DIAMOND), Card(5, Suit.HEART)]:
+                line.addToMain(card)
+            line.addToSide(Card(2, Suit.SPADE))
+            stats = line.getMainLine().stats
+            self.assertTrue(stats is line.getFullLine().stats and stats is line.stats)
+            self.assertTrue(stats.mainSuits[Suit.HEART] == 3 and stats.mainColors[Color.RED] == 4 and stats.mainColors[Color.BLACK] == 0)
+            self.assertTrue(stats.sideSuits[Suit.SPADE] == 1 and stats.sideRanks[2] == 1 and stats.mainRanks[2] == 1)
+            self.assertTrue(stats.colorRun == 4 and stats.suitRun == 1 and stats.parityRun == 1)
+            self.assertTrue(stats.lastRank[2] == 0 and stats.lastRank[12] == 2 and stats.lastRank[7] is None)
+            line.addToMain(Card(7, Suit.DIAMOND))
+            self.assertTrue(stats.colorRun == 5 and stats.suitRun == 1 and stats.parityRun == 2)
+
+    def testBoundedEngine(self):
+        results = []
+        for options in ({}, {'bounded_line': True}):
+            engine = Engine(['a', 'b', 'c'], dict(options, starting_hand_size = 20), random.Random(11))
+            agents = {'a': OracleAgent(), 'b': InferenceAgent(HypothesisSpace.fromRules(maxLeaves = 2)), 'c': RandomAgent(random.Random(1).choice)}
+            for rule in [myRules[2], myRules[4]]:
+                engine.playRound(rule, agents, 1000)
+                results.append((list(engine.line.getFullLine()), [p.score for p in engine.getPlayers()]))
+            data = snapshot(engine)
+            self.assertTrue(snapshot(restore(data, options = options)) == data)
+        self.assertTrue(results[:2] == results[2:])
+        self.assertTrue(isinstance(engine.line, BoundedLine) and len(engine.line.recent) == 1)
+        line = engine.line
+        engine.startRound(Rule('anything goes', lambda c,m,d,h: True))
+        self.assertTrue(line.file.closed and type(engine.line) is Line)
+
 class TestRule(unittest.TestCase):
     def testRuleBasics(self):
         line = Line()
@@ -174,6 +344,577 @@ class TestRule(unittest.TestCase):
         self.assertFalse(r8.test(Card('K',Suit.SPADE)))
         self.assertTrue(r8.test(Card('K',Suit.HEART)))
 
+class TestRuleCompilation(unittest.TestCase):
+    def testCompiledMatchesCallback(self):
+        line = Line()
+        Rule.setLine(line)
+        deck = Deck(2, random.Random(7))
+        for n in range(40):
+            line.addToMain(deck.deal())
+            for rule in myRules:
+                self.assertTrue(rule.table is not None)
+                plain = Rule(rule.name, rule.f)
+                for candidate in Card.allCards():
+                    self.assertTrue(rule.test(candidate) == plain.test(candidate))
+
+    def testDetectAndCombine(self):
+        alternate = Rule('alternate colors', lambda c,m,d,h: c.color != m[-1].color).compile()
+        red = Rule('red cards', lambda c,m,d,h: c.color == Color.RED).compile()
+        inHand = Rule('in hand', lambda c,m,d,h: h.hasCard(c)).compile()
+        self.assertTrue(alternate.window == 1 and red.window == 0 and inHand.window is None)
+        both = alternate.merge(red)
+        self.assertTrue(both.window == 1 and len(both.table) == 52)
+        self.assertTrue(both.table[Card(2, Suit.SPADE).code] == red.table[0])
+        self.assertTrue(both.table[Card(2, Suit.HEART).code] == 0)
+        self.assertTrue(alternate.merge(inHand).table is None)
+        self.assertTrue(isinstance(myRules[2].merge(red).table, dict)) # longer windows fill in as they go
+
+    def testMany(self):
+        line = Line()
+        deck = Deck(1, random.Random(3))
+        for n in range(5):
+            line.addToMain(deck.deal())
+        context = Context(line, Hand(deck.getCards()[:5]))
+        cards = deck.getCards()[:20] + deck.getCards()[:3] # duplicates keep their place
+        inHand = Rule('in hand', lambda c,m,d,h: h.hasCard(c))
+        for rule in myRules + [inHand, Rule(myRules[3].name, myRules[3].f)]:
+            self.assertTrue(rule.testMany(cards, context) == [rule.test(card, context) for card in cards])
+        self.assertTrue(Card.odds(cards, inHand, context) == 8 / 23)
+
+class TestVerdictCache(unittest.TestCase):
+    def testSameVerdicts(self):
+        hearts = ruledsl.rule('few hearts', (count(fullLine, each.suit == Suit.HEART) < 6) & (card.color != prev(1).color))
+        inHand = ruledsl.rule('pairs in hand', count(hand, each.rank == card.rank) > 0)
+        cache = VerdictCache(maxsize = 30)
+        for rule in [myRules[2], myRules[0], hearts, inHand]:
+            plain, cached = (Engine(['a', 'b'], options, random.Random(5)) for options in ({}, {'verdict_cache': cache}))
+            agents = {'a': OracleAgent(), 'b': OracleAgent()}
+            plain.playRound(rule, agents, 500)
+            cached.playRound(rule, agents, 500)
+            self.assertTrue(list(plain.line.getFullLine()) == list(cached.line.getFullLine()))
+        stats = cache.stats()
+        self.assertTrue(stats['hits'] > 0 and stats['bypasses'] > 0 and stats['evictions'] > 0 and stats['size'] == 30)
+
+    def testKeys(self):
+        cache = VerdictCache()
+        line = Line()
+        for card in [Card(2, Suit.HEART), Card(3, Suit.HEART), Card(4, Suit.SPADE)]:
+            line.addToMain(card)
+        context = Context(line, Hand(), cache)
+        self.assertTrue(myRules[2].testMany(Card.allCards(), context) == myRules[2].testMany(Card.allCards(), Context(line, Hand())))
+        self.assertTrue(cache.stats()['misses'] == 1 and myRules[2].test(Card(5, Suit.SPADE), context))
+        self.assertTrue(cache.stats()['hits'] == 1)
+        other = Line()
+        for card in [Card(9, Suit.CLUB), Card(3, Suit.SPADE), Card(4, Suit.HEART)]:
+            other.addToMain(card)
+        self.assertFalse(myRules[2].test(Card(5, Suit.SPADE), Context(other, None, cache))) # different suffix, different entry
+        self.assertTrue(cache.stats()['size'] == 2)
+        self.assertTrue(all(len(entry) == 2 for entry in cache.entries.values())) # no lines pinned by suffix entries
+        few = ruledsl.rule('few hearts', count(fullLine, each.suit == Suit.HEART) < 2)
+        few.test(Card(5, Suit.SPADE), context)
+        self.assertTrue(cache.entries[(few, id(line.getFullLine()), 3)][2] is line.getFullLine())
+        myRules[0].test(Card(5, Suit.SPADE), context)
+        Rule('plain', lambda c,m,d,h: True).test(Card(5, Suit.SPADE), context)
+        self.assertTrue(cache.stats()['bypasses'] == 2)
+
+class TestRuleDSL(unittest.TestCase):
+    def testMatchesLambdas(self):
+        alternate = ruledsl.rule('alternate', card.color != prev(1).color)
+        cycle = ruledsl.rule('cycle', card.suit == lookup(nextSuit, prev(1).suit))
+        corner = ruledsl.rule('corner', ((card.rank - prev(1).rank) % 13).oneOf(1, 2, 3))
+        parity = ruledsl.rule('parity', when(prev(1).parity == 1, card.color == Color.RED, card.color == Color.BLACK))
+        for rule, original in zip([alternate, cycle, corner, parity], [myRules[0], myRules[1], myRules[5], myRules[6]]):
+            self.assertTrue(rule.window == 1 and rule.table is not None)
+            self.assertTrue(analyze(rule).difference(analyze(original)) == 0)
+
+    def testFootprint(self):
+        hearts = ruledsl.rule('hearts', count(fullLine, each.suit == Suit.HEART) < 3)
+        self.assertTrue(hearts.footprint == Footprint(0, True, False) and hearts.window is None)
+        pair = ruledsl.rule('pair', known(2) & (prev(2).color == card.color) & (length(hand) > 1))
+        self.assertTrue(pair.footprint == Footprint(2, False, True) and pair.window is None)
+        self.assertTrue(ruledsl.rule('spades', card.suit == Suit.SPADE).window == 0)
+        self.assertTrue((count(mainLine) > 3).footprint.lookback is None)
+        line = Line()
+        line.addToMain(Card(2, Suit.HEART))
+        context = Context(line, Hand([Card(2, Suit.CLUB), Card(3, Suit.CLUB)]))
+        self.assertTrue(hearts.test(Card(4, Suit.HEART), context) and not pair.test(Card(4, Suit.HEART), context))
+        line.addToMain(Card(5, Suit.SPADE))
+        self.assertTrue(pair.test(Card(4, Suit.DIAMOND), context) and not pair.test(Card(4, Suit.CLUB), context))
+
+    def testOneOfExpressions(self):
+        # Expressions passed to oneOf are evaluated, and count towards the footprint
+        same = ruledsl.rule('same rank or a three', card.rank.oneOf(prev(1).rank, 3))
+        self.assertTrue(same.footprint == Footprint(1, False, False) and same.window == 1)
+        line = Line()
+        line.addToMain(Card(7, Suit.HEART))
+        context = Context(line, Hand())
+        self.assertTrue(same.test(Card(7, Suit.CLUB), context) and same.test(Card(3, Suit.CLUB), context))
+        self.assertFalse(same.test(Card(8, Suit.CLUB), context))
+        self.assertTrue(' in _k' in card.rank.oneOf(1, 2).source) # all constants: one set lookup
+
+    def testConstantFolding(self):
+        self.assertTrue((Constant(Card(3, Suit.HEART)).rank + 2 > 4).source == 'True')
+        self.assertTrue(((card.rank > 3) & True).source == '(c.rank > 3)' and ((card.rank > 3) | True).source == 'True')
+        self.assertTrue(when(~Constant(False), card.rank, prev(1).rank).source == 'c.rank')
+        with self.assertRaises(TypeError):
+            1 <= card.rank <= 3
+
+class TestContext(unittest.TestCase):
+    def testSeparateGames(self):
+        alternate = myRules[0]
+        first, second = Line(), Line()
+        first.addToMain(Card(2, Suit.HEART))
+        second.addToMain(Card(2, Suit.SPADE))
+        a, b = Context(first), Context(second)
+        self.assertTrue(alternate.test(Card(5, Suit.CLUB), a))
+        self.assertFalse(alternate.test(Card(5, Suit.CLUB), b))
+        self.assertTrue(Hand([Card(5, Suit.CLUB)]).odds(alternate, b) == 0)
+
+    def testInterleavedEngines(self):
+        engines = [Engine(['a', 'b'], {'starting_hand_size': 5}, random.Random(n)) for n in range(3)]
+        for engine in engines:
+            engine.startRound(myRules[1])
+        agent = OracleAgent()
+        while any(engine.roundActive for engine in engines):
+            for engine in engines:
+                if engine.roundActive:
+                    move = agent.chooseMove(engine, engine.currentPlayer())
+                    turn = engine.declareNoPlay() if move == NO_PLAY else engine.playCard(move)
+                    self.assertTrue(turn.outcome in (Outcome.MAIN, Outcome.NO_PLAY, Outcome.WIN)) # the oracle is never wrong
+
+class TestEngine(unittest.TestCase):
+    def testPlayRound(self):
+        for rule in myRules:
+            engine = Engine(['a', 'b', 'c'], {'starting_hand_size': 5})
+            agents = {'a': OracleAgent(), 'b': OracleAgent(), 'c': RandomAgent()}
+            winner = engine.playRound(rule, agents, maxTurns = 5000)
+            self.assertFalse(engine.roundActive)
+            if winner:
+                self.assertTrue(winner.score == 5)
+                self.assertTrue(len(winner.hand) == 0)
+
+    def testTurns(self):
+        engine = Engine(['a', 'b'])
+        engine.startRound(Rule('red cards', lambda c,m,d,h: c.color == Color.RED))
+        player = engine.currentPlayer()
+        self.assertTrue(player.name == 'a')
+        card = next(iter(player.hand))
+        size = len(player.hand)
+        turn = engine.playCard(card)
+        self.assertTrue(turn.player is player and turn.cards == [card])
+        if card.color == Color.RED:
+            self.assertTrue(turn.outcome == Outcome.MAIN and len(player.hand) == size - 1)
+            self.assertTrue(engine.line.getMainLine()[-1] == card)
+        else:
+            self.assertTrue(turn.outcome == Outcome.SIDE and len(player.hand) == size)
+            self.assertTrue(engine.line.getFullLine()[-1] == card)
+        self.assertTrue(engine.currentPlayer().name == 'b')
+        missing = next(c for c in Card.allCards() if not engine.currentPlayer().hand.hasCard(c))
+        with self.assertRaises(IllegalMove):
+            engine.playCard(missing)
+        turn = engine.declareNoPlay()
+        self.assertTrue(turn.outcome in (Outcome.PENALTY, Outcome.NO_PLAY))
+
+    def testPlayable(self):
+        inHand = Rule('pairs in hand', lambda c,m,d,h: h.count(c) == 0 and any(x.rank == c.rank for x in h))
+        for rule in [myRules[0], myRules[2], inHand]:
+            engine = Engine(['a', 'b', 'c'], {}, random.Random(4))
+            engine.startRound(rule)
+            agent = RandomAgent(random.Random(5).choice)
+            while engine.roundActive and engine.turns < 300:
+                for player in engine.getPlayers():
+                    self.assertTrue(engine.playable(player) == player.hand.passingMask(rule, Context(engine.line, player.hand)))
+                passing = engine.playable()
+                turn = engine.declareNoPlay() if engine.turns % 7 == 0 else engine.playCard(agent.chooseMove(engine, engine.currentPlayer()))
+                if turn.outcome == Outcome.PENALTY:
+                    self.assertTrue(1 << turn.cards[0].code == passing & -passing)
+                elif turn.outcome in (Outcome.MAIN, Outcome.SIDE):
+                    self.assertTrue((passing >> turn.cards[0].code & 1 == 1) == (turn.outcome == Outcome.MAIN))
+
+    def testPlayableLookups(self):
+        # With a VerdictCache, every playable() call is a cache lookup; with metrics on, every call
+        # counts as one evaluation of the rule
+        cache = VerdictCache()
+        engine = Engine(['a', 'b'], {'verdict_cache': cache}, random.Random(4))
+        engine.startRound(myRules[2])
+        first = engine.playable()
+        self.assertTrue(engine.playable() == first and cache.stats()['hits'] == 1)
+        collected = metrics.enable(metrics.Metrics())
+        try:
+            engine = Engine(['a', 'b'], {}, random.Random(4))
+            engine.startRound(myRules[1])
+            for n in range(3):
+                engine.playable()
+        finally:
+            metrics.disable()
+        self.assertTrue(collected.snapshot()['rules'][myRules[1].name]['count'] == 3)
+
+class TestResults(unittest.TestCase):
+    def testStore(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.db')
+            engine = Engine(['a', 'b', 'c'], {'starting_hand_size': 5}, random.Random(6))
+            agents = {'a': OracleAgent(), 'b': RandomAgent(random.Random(7).choice), 'c': RandomAgent(random.Random(8).choice)}
+            with ResultsStore(path, batchSize = 2).attach(engine) as store:
+                for rule in myRules[:5]:
+                    engine.playRound(rule, agents, 2000)
+                self.assertTrue(sum(engine.roundScores.values()) >= engine.STARTING_HAND_SIZE)
+                store.record('unfinished', None, 2000, 40, {})
+            with ResultsStore(path) as store:
+                board = store.leaderboard()
+                self.assertTrue([(name, total) for name, total, rounds, wins in board] ==
+                                sorted(((p.name, p.score) for p in engine.getPlayers()), key=lambda k: (-k[1], k[0])))
+                self.assertTrue(sum(wins for name, total, rounds, wins in board) == 5 and board[0][2] == 5)
+                self.assertTrue(store.ruleStats('unfinished') == [('unfinished', 1, 0, 2000.0, 2000, 2000)])
+                self.assertTrue(len(store.ruleStats()) == 6)
+                history = store.playerHistory('a', 2)
+                self.assertTrue(len(history) == 2 and history[0][1] == myRules[4].name and history[0][0] > history[1][0])
+                self.assertTrue(store.record('next', 'a', 1, 1, {'a': 1}) == 7)
+            with tempfile.TemporaryDirectory() as directory:
+                with ResultsStore(os.path.join(directory, 'tournament.db')) as store:
+                    runTournament([0, 2], rounds = 4, players = 3, handSize = 5, workers = 1, chunkSize = 2, store = store)
+                    self.assertTrue(sum(rounds for rule, rounds, *rest in store.ruleStats()) == 8)
+
+    def testAbandonedRounds(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.db')
+            engine = Engine(['a', 'b'], {'starting_hand_size': 5}, random.Random(6))
+            agents = {'a': RandomAgent(random.Random(7).choice), 'b': RandomAgent(random.Random(8).choice)}
+            with self.assertRaises(KeyboardInterrupt):
+                with ResultsStore(path).attach(engine):
+                    self.assertTrue(engine.playRound(myRules[0], agents, 3) is None)
+                    raise KeyboardInterrupt
+            # the interactive game saves the round that was being played when it was stopped
+            moves = iter(['a', 'y', 'b', 'n', '', 'NO PLAY', '', 'NO PLAY'])
+            def typed(prompt = ''):
+                move = next(moves, None)
+                if move is None:
+                    raise KeyboardInterrupt
+                return move
+            with contextlib.redirect_stdout(io.StringIO()), unittest.mock.patch('eleusis.input', typed, create = True):
+                game = Game(myRules[:1], {'results_db': path, 'seed': 3})
+                with self.assertRaises(KeyboardInterrupt):
+                    game.start()
+            with ResultsStore(path) as store:
+                self.assertTrue(store.ruleStats()[0][:3] == (myRules[0].name, 2, 0))
+                self.assertTrue(store.leaderboard() == [])
+
+class TestTournament(unittest.TestCase):
+    def testDeterministicAcrossWorkers(self):
+        serial = runTournament([0, 2], rounds = 6, players = 3, handSize = 5, workers = 1, chunkSize = 2)
+        pooled = runTournament([0, 2], rounds = 6, players = 3, handSize = 5, workers = 2, chunkSize = 2)
+        self.assertTrue(serial == pooled)
+        self.assertTrue(serial[0].rounds == 6)
+        self.assertTrue(serial[0].metrics['turns'].count + serial[0].unfinished == 6)
+
+    def testStatsMerge(self):
+        a, b, c = Stats(), Stats(), Stats()
+        for x in (3, 5):
+            a.add(x)
+            c.add(x)
+        b.add(10)
+        c.add(10)
+        self.assertTrue(a.merge(b) == c)
+        self.assertTrue(c.mean() == 6 and c.low == 3 and c.high == 10)
+
+class TestAnalysis(unittest.TestCase):
+    def testAnalyze(self):
+        alternate = Rule('alternate colors', lambda c,m,d,h: c.color != m[-1].color)
+        same = Rule('same color', lambda c,m,d,h: c.color == m[-1].color)
+        impossible = alternate.merge(same)
+        self.assertTrue(analyze(alternate).passProbability() == .5)
+        self.assertTrue(alternate.odds() == .5)
+        self.assertTrue(analyze(alternate).difference(analyze(same)) == 1)
+        self.assertTrue(analyze(alternate).deadEndRate() == 0)
+        self.assertTrue(analyze(impossible).deadEndRate() == 1)
+        self.assertTrue(len(analyze(impossible).deadEnds()) == 52)
+
+    def testDepth(self):
+        afterAce = Rule('two cards after an ace', lambda c,m,d,h: m[-2].rank == 1)
+        with self.assertRaises(ValueError):
+            analyze(afterAce)
+        self.assertTrue(analyze(afterAce, 2).passProbability() == 1/13)
+        self.assertTrue(analyze(afterAce, 2).stateOdds([Card('A', Suit.CLUB), Card(5, Suit.HEART)]) == 1)
+
+    def testCompiledTables(self):
+        # Tables built from compiled masks match running the rule against every state
+        alternate = Rule('alternate colors', lambda c,m,d,h: c.color != m[-1].color) # compiled on the fly
+        climb = Rule('higher than two back', lambda c,m,d,h: c.rank > m[-2].rank, 2)
+        for rule in [myRules[0], myRules[5], alternate, climb, myRules[0].merge(climb)]:
+            self.assertTrue(analyze(rule, 2).table == tabulate(rule, 2))
+        deep = analyze(climb, 3)
+        for state in [[Card(2, Suit.HEART), Card(9, Suit.CLUB), Card(5, Suit.SPADE)], [Card('K', Suit.CLUB), Card(3, Suit.CLUB), Card('A', Suit.HEART)]]:
+            self.assertTrue(deep.rowAt(deep.indexOf(state)) == climb.acceptMask(Context(stateLine(state), Hand())))
+        self.assertTrue(deep.rows[:52 * 52] == analyze(climb, 2).rows)
+        with self.assertRaises(ValueError):
+            analyze(myRules[2], 2)
+        both = myRules[0].overlay(myRules[1])
+        self.assertTrue(both.parts is not None and analyze(both, 3).table == analyze(myRules[0], 3).table | analyze(myRules[1], 3).table)
+
+class TestGenerator(unittest.TestCase):
+    def testPool(self):
+        generator = RuleGenerator()
+        pool = generator.pool(.2, .3, 3, 10)
+        self.assertTrue(len(pool) == 10 and generator.duplicates > 0 and generator.deadEnds > 0)
+        for candidate in pool:
+            analysis = analyze(candidate.build())
+            self.assertTrue(analysis.table == candidate.table and analysis.deadEndRate() == 0)
+            self.assertTrue(.2 <= analysis.passProbability() <= .3)
+        tables = [c.table for c in generator.candidates(3)]
+        self.assertTrue(len(tables) == len(set(tables)))
+
+class TestBot(unittest.TestCase):
+    def testTranspose(self):
+        space = HypothesisSpace.fromRules(maxLeaves = 2)
+        for i, candidate in enumerate(space.candidates):
+            for last, card in [(0, 0), (5, 17), (51, 50), (26, 3)]:
+                self.assertTrue(space.columns[last * 52 + card] >> i & 1 == candidate.table >> (last * 64 + card) & 1)
+
+    def testInference(self):
+        space = HypothesisSpace.fromRules()
+        engine = Engine(['bot', 'random'], {}, random.Random(6))
+        agent = InferenceAgent(space)
+        agents = {'bot': agent, 'random': RandomAgent(random.Random(7).choice)}
+        engine.playRound(myRules[7], agents, 2000)
+        agent.inference.observe(engine.line)
+        survivors = agent.inference.survivors()
+        self.assertTrue(any(analyze(c.build()).table == analyze(myRules[7]).table for c in survivors))
+        self.assertTrue(len(survivors) < space.size / 10)
+        wins = sum(engine.playRound(rule, agents, 2000).name == 'bot' for rule in myRules for n in range(3))
+        self.assertTrue(wins > len(myRules) * 2)
+
+    def testObserveFirstRow(self):
+        # Side cards played before the bot's first look at the line rule hypotheses out too
+        space = HypothesisSpace.fromRules(maxLeaves = 1)
+        inference = InferenceAgent(space).inference
+        accepts = lambda i, last, c: space.candidates[i].table >> (last.code * 64 + c.code) & 1
+        first, side, later, main = Card.parse('2 of Hearts'), Card.parse('3 of Clubs'), Card.parse('4 of Hearts'), Card.parse('5 of Spades')
+        line = Line()
+        line.addToMain(first)
+        line.addToSide(side)
+        inference.observe(line)
+        expected = [i for i in range(space.size) if not accepts(i, first, side)]
+        self.assertTrue(0 < len(expected) < space.size)
+        self.assertTrue(list(codesIn(inference.alive)) == expected)
+        line.addToSide(later)
+        line.addToMain(main)
+        inference.observe(line)
+        expected = [i for i in expected if not accepts(i, first, later) and accepts(i, first, main)]
+        self.assertTrue(list(codesIn(inference.alive)) == expected)
+
+class TestTurnLog(unittest.TestCase):
+    def testReplay(self):
+        custom = Rule('higher than three', lambda c,m,d,h: c.rank > 3)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'turns.log')
+            engine = Engine(['a', 'b'], {'starting_hand_size': 6}, random.Random(4))
+            agents = {'a': OracleAgent(), 'b': RandomAgent(random.Random(5).choice)}
+            played = []
+            with TurnLog(path).attach(engine):
+                for rule in [myRules[0], custom, myRules[2]]:
+                    engine.playRound(rule, agents, 200)
+                    played.append((list(engine.line.getFullLine()), [list(p.hand) for p in engine.getPlayers()], engine.turns))
+            turns = []
+            rounds = list(replay(path, onTurn = lambda r, outcome, player, card: turns.append(outcome)))
+        self.assertTrue(len(rounds) == 3 and len(turns) == sum(t for f, h, t in played))
+        self.assertTrue(rounds[0].rule is myRules[0] and rounds[1].rule is None and rounds[1].ruleName == custom.name)
+        for replayed, (full, hands, count) in zip(rounds, played):
+            self.assertTrue(list(replayed.line.getFullLine()) == full)
+            self.assertTrue([list(hand) for hand in replayed.hands] == hands and replayed.turns == count)
+
+    def testFieldLimits(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'turns.log')
+            with TurnLog(path) as log:
+                for engine in [Engine(['a', 'é' * 128]), Engine(['a', 'b'], {'starting_hand_size': 256}), Engine([str(n) for n in range(256)])]:
+                    with self.assertRaises(ValueError):
+                        log.attach(engine)
+                    self.assertTrue(engine.onRoundStart == [] and engine.onTurn == [])
+                log.attach(Engine(['a', 'é' * 127]))
+            self.assertTrue(os.path.getsize(path) == 0)
+
+class TestSnapshot(unittest.TestCase):
+    def testRoundTrip(self):
+        engine = Engine(['a', 'b', 'c', 'd'], {}, random.Random(8))
+        engine.startRound(myRules[3])
+        agent = RandomAgent(random.Random(9).choice)
+        for n in range(30):
+            engine.playCard(agent.chooseMove(engine, engine.currentPlayer()))
+        engine.currentPlayer().score = -3
+        data = snapshot(engine)
+        self.assertTrue(len(data) < 400)
+        restored = restore(data, rng = random.Random(1))
+        self.assertTrue(restored.rule is engine.rule and restored.turns == engine.turns and restored.roundActive)
+        self.assertTrue(restored.currentPlayer().name == engine.currentPlayer().name)
+        for mine, theirs in zip(engine.getPlayers(), restored.getPlayers()):
+            self.assertTrue(mine.name == theirs.name and mine.score == theirs.score)
+            self.assertTrue(list(mine.hand) == list(theirs.hand))
+        self.assertTrue(list(restored.line.getFullLine()) == list(engine.line.getFullLine()))
+        self.assertTrue(sorted(restored.deck.codes) == sorted(engine.deck.codes))
+        self.assertTrue(snapshot(restored) == data)
+        agents = {name: OracleAgent() for name in 'abcd'}
+        while restored.roundActive: # the restored game plays on
+            move = agents[restored.currentPlayer().name].chooseMove(restored, restored.currentPlayer())
+            restored.declareNoPlay() if move == NO_PLAY else restored.playCard(move)
+        self.assertTrue(restore(snapshot(restored)).winner.name == restored.winner.name)
+
+    def testTruncated(self):
+        engine = Engine(['a', 'b'], {}, random.Random(8))
+        engine.startRound(myRules[3])
+        data = snapshot(engine)
+        for end in range(len(data)):
+            with self.assertRaises(ValueError):
+                restore(data[:end])
+
+    def testUnregisteredRule(self):
+        engine = Engine(['a', 'b'])
+        self.assertTrue(restore(snapshot(engine)).rule is None)
+        engine.startRound(Rule('red cards', lambda c,m,d,h: c.color == Color.RED))
+        with self.assertRaises(ValueError):
+            snapshot(engine)
+
+class TestBenchmarks(unittest.TestCase):
+    def testCompare(self):
+        old = [{'name': 'deck.deal', 'params': {'decks': 1}, 'ns': 100}, {'name': 'round', 'params': {'rule': 0}, 'ns': 100}]
+        new = [{'name': 'deck.deal', 'params': {'decks': 1}, 'ns': 105}, {'name': 'round', 'params': {'rule': 0}, 'ns': 150}]
+        regressions = compare(old, new)
+        self.assertTrue(len(regressions) == 1 and regressions[0][0] is new[1] and regressions[0][2] == 1.5)
+
+    def testRun(self):
+        results = runBenchmarks(repeat = 1, only = ['card', 'deck'])
+        self.assertTrue({result['name'] for result in results} == {'card.compare', 'card.valAsNum', 'card.parse', 'deck.new', 'deck.deal'})
+        self.assertTrue(all(result['ns'] > 0 for result in results))
+
+class TestMetrics(unittest.TestCase):
+    def testCollect(self):
+        original = Rule.test
+        collected = metrics.enable(metrics.Metrics())
+        try:
+            self.assertTrue(metrics.enabled() and Rule.test is not original)
+            engine = Engine(['a', 'b'], {'starting_hand_size': 30}, random.Random(2))
+            engine.playRound(myRules[1], {'a': OracleAgent(), 'b': OracleAgent()}, 500)
+            myRules[0].test(Card(2, Suit.CLUB), Context(engine.line, Hand()))
+        finally:
+            metrics.disable()
+        self.assertTrue(Rule.test is original and not metrics.enabled())
+        data = collected.snapshot()
+        self.assertTrue(data['rules'][myRules[0].name]['count'] == 1 and data['rules'][myRules[1].name]['count'] >= engine.turns)
+        self.assertTrue(data['timings']['turn']['count'] == engine.turns and data['refolds'] == engine.deck.refolds)
+        self.assertTrue(data['deals'] == data['timings']['deck.deal']['count'] >= 61)
+        self.assertTrue(json.loads(collected.dumpJSON()) is not None and 'turn' in collected.dumpText())
+
+class TestServer(unittest.TestCase):
+    def run_with_server(self, server, coroutine):
+        async def main():
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'eleusis.sock')
+                listener = await server.listen(path = path)
+                async with listener:
+                    return await coroutine(path)
+        return asyncio.run(main())
+
+    def testRooms(self):
+        server = Server(seats = 2, options = {'starting_hand_size': 4}, seed = 1)
+        results = self.run_with_server(server, lambda path: simulate(5, 2, path = path, seed = 2))
+        self.assertTrue(len(results) == 10 and server.roundsPlayed == 5)
+        for message in results:
+            self.assertTrue(message['type'] == 'won' and message['winner'] in message['scores'])
+
+    def testMalformedJoin(self):
+        server = Server(seats = 2, seed = 1)
+        async def send(path):
+            reader, writer = await asyncio.open_unix_connection(path)
+            replies = []
+            for message in [{'type': 'join', 'room': ['r'], 'name': 'a'}, {'type': 'join', 'room': 'r', 'name': 5},
+                            {'type': 'join', 'name': 'a'}, {'type': 'join', 'room': 'r', 'name': 'a'}]:
+                writer.write(json.dumps(message).encode() + b'\n')
+                replies.append(json.loads(await reader.readline()))
+            writer.close()
+            return replies
+        replies = self.run_with_server(server, send)
+        self.assertTrue([reply['type'] for reply in replies] == ['error', 'error', 'error', 'joined'])
+
+    def testManyRooms(self):
+        # More connections at once than asyncio's default listen backlog of 100
+        server = Server(seats = 3, options = {'starting_hand_size': 3}, seed = 1)
+        results = self.run_with_server(server, lambda path: simulate(60, 3, path = path, seed = 2))
+        self.assertTrue(len(results) == 180 and server.roundsPlayed == 60)
+
+    def testTimeout(self):
+        server = Server(seats = 2, turnTimeout = .01, options = {'starting_hand_size': 2}, seed = 1)
+        class Idle: # never answers; the server declares NO PLAY for it
+            def chooseMove(self, message):
+                return {'type': 'ping'}
+        async def play(path):
+            return await asyncio.gather(runClient('a', 'room', path = path, strategy = Idle()),
+                                        runClient('b', 'room', path = path, strategy = Idle()))
+        first, second = self.run_with_server(server, play)
+        self.assertTrue(first == second)
+
+    def testEveryoneLeaves(self):
+        # A room emptied mid-round abandons the round and goes away
+        server = Server(seats = 2, options = {'starting_hand_size': 20}, seed = 1)
+        async def play(path):
+            writers = []
+            for name in ('a', 'b'):
+                reader, writer = await asyncio.open_unix_connection(path)
+                writer.write(json.dumps({'type': 'join', 'room': 'room', 'name': name}).encode() + b'\n')
+                writers.append(writer)
+            while 'room' not in server.rooms or not server.rooms['room'].playing():
+                await asyncio.sleep(.001)
+            room = server.rooms['room']
+            for writer in writers:
+                writer.close()
+            await room.task
+            return room
+        room = self.run_with_server(server, play)
+        self.assertTrue(room.engine.winner is None and not room.engine.roundActive and room.engine.turns <= 2)
+        self.assertTrue(server.rooms == {} and server.roundsPlayed == 0)
+
+class TestRenderer(unittest.TestCase):
+    def testFrames(self):
+        class Output(io.StringIO):
+            writes = 0
+            def write(self, text):
+                Output.writes += 1
+                return io.StringIO.write(self, text)
+        out = Output()
+        renderer = Renderer(out, rows = 5)
+        engine = Engine(['a', 'b'], {}, random.Random(3))
+        engine.startRound(myRules[0])
+        printed = io.StringIO()
+        with contextlib.redirect_stdout(printed): # short lines look just like printLine
+            engine.line.printLine()
+        self.assertTrue(renderer.lineText(engine.line) == printed.getvalue())
+        agents = {'a': RandomAgent(random.Random(1).choice), 'b': RandomAgent(random.Random(2).choice)}
+        for n in range(40):
+            engine.playCard(agents[engine.currentPlayer().name].chooseMove(engine, engine.currentPlayer()))
+        renderer.show(renderer.turnText(engine, engine.currentPlayer()))
+        frame = out.getvalue()
+        self.assertTrue(Output.writes == 1 and frame.startswith(CLEAR))
+        hidden = len(engine.line.getMainLine()) - 5
+        self.assertTrue(f"... {hidden} more" in frame and frame.count('|') == 5 + 1 + len(engine.getPlayers()))
+        self.assertTrue(engine.line.getMainLine()[-1].fancyFormat() in frame.split('\n')[7])
+        for card in engine.currentPlayer().hand:
+            self.assertTrue(f"    {card.fancyFormat()}\n" in frame)
+
+    def testBoundedLineFrames(self):
+        # The game keeps every row it draws in memory, so frames never read a BoundedLine's spill file
+        game = Game(myRules, {'bounded_line': True, 'line_rows': 4})
+        self.assertTrue(game.options['bounded_line'] == 4)
+        frames = []
+        for options in ({}, game.options):
+            engine = Engine(['a', 'b'], dict(options, starting_hand_size = 30), random.Random(3))
+            engine.startRound(myRules[0])
+            agents = {'a': RandomAgent(random.Random(1).choice), 'b': RandomAgent(random.Random(2).choice)}
+            for n in range(60):
+                engine.playCard(agents[engine.currentPlayer().name].chooseMove(engine, engine.currentPlayer()))
+            if options:
+                self.assertTrue(engine.line.spilledMain > 0)
+                engine.line.spilled = None # any read from the file would fail
+            frames.append(game.renderer.lineText(engine.line))
+        self.assertTrue(frames[0] == frames[1])
+
 class TestEleusis(unittest.TestCase):
     # pain to test because of all the terminal i/o.
     # decided to play test instead
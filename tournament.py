@@ -0,0 +1,182 @@
+#  © 2018 Matt Fan
+# http://mattfan.me/
+
+from argparse import ArgumentParser
+from multiprocessing import Pool
+from random import Random
+from rules import rules as myRules
+from engine import Engine, RandomAgent, OracleAgent
+from bot import HypothesisSpace, InferenceAgent
+from results import ResultsStore
+
+# Plays lots of automated rounds for each rule in rules.py, spread over a pool of worker processes,
+# and collects statistics on how each rule plays.
+# Rounds are split into chunks, and every chunk gets its own random stream seeded from
+# (seed, rule, chunk). The results only depend on the seed, never on how many workers there are
+# or which worker ran which chunk.
+# With a ResultsStore, every round is also returned from its worker and written to the store.
+
+METRICS = ('turns', 'mainLine', 'sideLine', 'scoreSpread')
+
+
+class Stats:
+    # Running summary of an integer metric. Everything is kept as integers so that merging the
+    # partial results from each worker gives the same answer in any order.
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.squares = 0
+        self.low = None
+        self.high = None
+
+    def add(self, x):
+        self.count += 1
+        self.total += x
+        self.squares += x * x
+        self.low = x if self.low is None else min(self.low, x)
+        self.high = x if self.high is None else max(self.high, x)
+
+    def merge(self, other):
+        if other.count:
+            self.count += other.count
+            self.total += other.total
+            self.squares += other.squares
+            self.low = other.low if self.low is None else min(self.low, other.low)
+            self.high = other.high if self.high is None else max(self.high, other.high)
+        return self
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def stdev(self):
+        if not self.count:
+            return 0
+        return max(self.squares / self.count - self.mean() ** 2, 0) ** .5
+
+    def __eq__(self, other):
+        return vars(self) == vars(other)
+
+
+class RuleStats:
+    # Aggregate results of every round played under one rule
+    def __init__(self, ruleIndex):
+        self.ruleIndex = ruleIndex
+        self.rounds = 0
+        self.unfinished = 0 # rounds that hit maxTurns before anyone won
+        self.metrics = { name: Stats() for name in METRICS }
+
+    def addRound(self, engine, finished):
+        self.rounds += 1
+        if not finished:
+            self.unfinished += 1
+            return
+        scores = [p.score for p in engine.getPlayers()]
+        mainLine = len(engine.line.getMainLine())
+        self.metrics['turns'].add(engine.turns)
+        self.metrics['mainLine'].add(mainLine)
+        self.metrics['sideLine'].add(len(engine.line.getFullLine()) - mainLine)
+        self.metrics['scoreSpread'].add(max(scores) - min(scores))
+
+    def merge(self, other):
+        self.rounds += other.rounds
+        self.unfinished += other.unfinished
+        for name in METRICS:
+            self.metrics[name].merge(other.metrics[name])
+        return self
+
+    def __eq__(self, other):
+        return vars(self) == vars(other)
+
+
+_space = None # HypothesisSpace for inference agents, built once per process
+
+
+def makeAgent(kind, rng):
+    global _space
+    if kind == 'oracle':
+        return OracleAgent()
+    if kind == 'random':
+        return RandomAgent(rng.choice)
+    if kind == 'inference':
+        if _space is None:
+            _space = HypothesisSpace.fromRules()
+        return InferenceAgent(_space)
+    raise ValueError(f"Unknown agent '{kind}'")
+
+
+def playChunk(task):
+    # Worker: plays one chunk of rounds for one rule. Rules are sent as indices into rules.py,
+    # since lambdas can't be pickled.
+    ruleIndex, chunk, rounds, seed, options = task
+    rng = Random(f"{seed}/{ruleIndex}/{chunk}")
+    rule = myRules[ruleIndex]
+    names = [f"player{n}" for n in range(options['players'])]
+    stats = RuleStats(ruleIndex)
+    played = [] # (rule, winner, turns, mainLine, scores) of each round, for a ResultsStore
+    for n in range(rounds):
+        engine = Engine(names, {'starting_hand_size': options['handSize']}, rng)
+        agents = { name: makeAgent(options['agent'], rng) for name in names }
+        winner = engine.playRound(rule, agents, options['maxTurns'])
+        stats.addRound(engine, winner is not None)
+        if options['record']:
+            played.append((rule.name, winner.name if winner else None, engine.turns,
+                           len(engine.line.getMainLine()), engine.roundScores))
+    return stats, played
+
+
+def runTournament(ruleIndices = None, rounds = 1000, players = 4, handSize = 12, agent = 'oracle',
+                  workers = None, seed = 0, chunkSize = 50, maxTurns = 2000, store = None):
+    # Plays `rounds` rounds of every rule and returns {ruleIndex: RuleStats}.
+    # workers=None uses every core; workers=1 plays everything in this process.
+    # Every round is recorded in store, a ResultsStore, if one is given.
+    ruleIndices = range(len(myRules)) if ruleIndices is None else ruleIndices
+    options = { 'players': players, 'handSize': handSize, 'agent': agent, 'maxTurns': maxTurns,
+                'record': store is not None }
+    tasks = []
+    for ruleIndex in ruleIndices:
+        for chunk, start in enumerate(range(0, rounds, chunkSize)):
+            tasks.append((ruleIndex, chunk, min(chunkSize, rounds - start), seed, options))
+    results = { ruleIndex: RuleStats(ruleIndex) for ruleIndex in ruleIndices }
+    def collect(chunks):
+        for stats, played in chunks:
+            results[stats.ruleIndex].merge(stats)
+            for row in played:
+                store.record(*row)
+    if workers == 1:
+        collect(map(playChunk, tasks))
+    else:
+        with Pool(workers) as pool:
+            collect(pool.imap_unordered(playChunk, tasks))
+    if store is not None:
+        store.flush()
+    return results
+
+
+def report(results):
+    lines = []
+    for ruleIndex, stats in sorted(results.items()):
+        lines.append(f"[{ruleIndex}] {myRules[ruleIndex].name}")
+        lines.append(f"    rounds: {stats.rounds}    unfinished: {stats.unfinished}")
+        for name in METRICS:
+            s = stats.metrics[name]
+            lines.append(f"    {name:12} mean {s.mean():8.2f}   stdev {s.stdev():8.2f}   min {s.low}   max {s.high}")
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description='Play automated rounds of every rule and report statistics.')
+    parser.add_argument('--rounds', type=int, default=1000, help='rounds per rule')
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--hand-size', type=int, default=12)
+    parser.add_argument('--agent', choices=['oracle', 'random', 'inference'], default='oracle')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--seed', default=0)
+    parser.add_argument('--max-turns', type=int, default=2000)
+    parser.add_argument('--rule', type=int, action='append', help='only play this rule (index into rules.py)')
+    parser.add_argument('--results', help='also record every round in this SQLite database')
+    args = parser.parse_args()
+    store = ResultsStore(args.results) if args.results else None
+    print(report(runTournament(args.rule, args.rounds, args.players, args.hand_size, args.agent,
+                               args.workers, args.seed, maxTurns=args.max_turns, store=store)))
+    if store is not None:
+        store.close()
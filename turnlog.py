@@ -0,0 +1,176 @@
+#  © 2018 Matt Fan
+# http://mattfan.me/
+
+from struct import Struct
+from cardobjects import Card, Hand
+from eleusisobjects import Line
+from engine import Outcome
+from rules import rules as myRules
+
+# Append-only binary log of every turn an Engine plays, and a replayer that rebuilds the line,
+# hands and scores from it while streaming through the file.
+#
+# The log is a sequence of records, each starting with a kind byte:
+#   ROUND    kind, rule (index into the rule registry, -1 if it isn't registered), starting hand
+#            size, number of players, then each player's name, the rule's name if it isn't
+#            registered, each player's dealt hand, and the first card on the MAIN LINE
+#   a turn   the Outcome's value as the kind, player index, card played (NO_CARD for a NO PLAY,
+#            whose cards are the player's whole hand), then the cards dealt to the player
+# Cards are single-byte codes, so a typical turn takes 6 bytes. The starting hand size, the number
+# of players and the length of each name (in UTF-8) are single bytes too, so attach() turns away an
+# engine that doesn't fit them before anything is written.
+# A log should only be written by one Engine at a time, since turns don't say which game they're from.
+
+ROUND = 0xF0
+NO_CARD = 0xFF
+_round = Struct('<BhBB')
+_roundBody = Struct('<hBB') # _round without the kind byte
+_turn = Struct('<BBBH')
+_turnBody = Struct('<BBH')
+_short = Struct('<H')
+
+
+class TurnLog:
+    def __init__(self, path, registry = myRules):
+        self.file = open(path, 'ab')
+        self.registry = registry
+        self.seats = {} # player name -> index, for the round being logged
+
+    def attach(self, engine):
+        # Logs every round and turn the engine plays from now on
+        self.checkFits(engine)
+        engine.onRoundStart.append(self.roundStarted)
+        engine.onTurn.append(self.turnPlayed)
+        return self
+
+    def checkFits(self, engine):
+        players = list(engine.getPlayers())
+        if len(players) > 0xFF:
+            raise ValueError(f"The turn log can record at most 255 players, not {len(players)}")
+        if not 0 <= engine.STARTING_HAND_SIZE <= 0xFF:
+            raise ValueError(f"The turn log can't record a starting hand size of {engine.STARTING_HAND_SIZE}")
+        for player in players:
+            if len(player.name.encode()) > 0xFF:
+                raise ValueError(f"Player name '{player.name[:20]}...' is longer than the 255 bytes the turn log allows")
+
+    def roundStarted(self, engine):
+        players = list(engine.getPlayers())
+        self.seats = { player.name: i for i, player in enumerate(players) }
+        ruleIndex = next((i for i, rule in enumerate(self.registry) if rule is engine.rule), -1)
+        if ruleIndex > 0x7FFF:
+            ruleIndex = -1 # past what the index field holds, so saved by name like an unregistered rule
+        parts = [_round.pack(ROUND, ruleIndex, engine.STARTING_HAND_SIZE, len(players))]
+        for player in players:
+            name = player.name.encode()
+            parts.append(bytes([len(name)]) + name)
+        if ruleIndex == -1:
+            name = engine.rule.name.encode()
+            if len(name) > 0xFFFF:
+                raise ValueError(f"Rule name '{engine.rule.name[:20]}...' is longer than the 65535 bytes the turn log allows")
+            parts.append(_short.pack(len(name)) + name)
+        for player in players:
+            parts.append(_short.pack(len(player.hand)) + bytes(card.code for card in player.hand))
+        parts.append(bytes([engine.line.getMainLine()[0].code]))
+        self.file.write(b''.join(parts))
+
+    def turnPlayed(self, engine, turn):
+        card = NO_CARD if turn.outcome == Outcome.NO_PLAY else turn.cards[0].code
+        self.file.write(_turn.pack(turn.outcome.value, self.seats[turn.player.name], card, len(turn.dealt))
+                        + bytes(c.code for c in turn.dealt))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RoundReplay:
+    # One round rebuilt from the log. scores (points for this round) and winner are set once it's won.
+    def __init__(self, rule, ruleName, players, handSize):
+        self.rule = rule # the Rule from the registry, or None if it wasn't registered
+        self.ruleName = ruleName
+        self.players = players
+        self.handSize = handSize
+        self.hands = [Hand() for player in players]
+        self.line = Line()
+        self.turns = 0
+        self.winner = None
+        self.scores = None
+
+    def apply(self, outcome, player, card, dealt):
+        # Same bookkeeping the Engine does for each outcome
+        hand = self.hands[player]
+        self.turns += 1
+        if outcome == Outcome.MAIN or outcome == Outcome.PENALTY:
+            self.line.addToMain(hand.removeCard(card))
+        elif outcome == Outcome.SIDE:
+            self.line.addToSide(hand.removeCard(card))
+        elif outcome == Outcome.NO_PLAY:
+            for c in list(hand):
+                self.line.addToSide(c)
+            hand = self.hands[player] = Hand()
+        else:
+            self.hands[player] = Hand()
+            self.winner = self.players[player]
+            self.scores = { name: self.handSize - len(h) for name, h in zip(self.players, self.hands) }
+        for code in dealt:
+            hand.addCard(Card.fromCode(code))
+
+
+def readExactly(file, size):
+    data = file.read(size)
+    if len(data) != size:
+        raise EOFError('The turn log ends in the middle of a record')
+    return data
+
+
+def replay(path, registry = myRules, onTurn = None):
+    # Streams through the log, yielding a RoundReplay as each round finishes (winner is None for a
+    # round that stopped without a winner). onTurn(round, outcome, player index, card) is called
+    # before each turn is applied, so round.line is the line the card was played against.
+    outcomes = list(Outcome)
+    current = None
+    with open(path, 'rb') as file:
+        while True:
+            kind = file.read(1)
+            if not kind:
+                break
+            kind = kind[0]
+            if kind == ROUND:
+                if current is not None and current.winner is None:
+                    yield current
+                ruleIndex, handSize, count = _roundBody.unpack(readExactly(file, _roundBody.size))
+                players = []
+                for n in range(count):
+                    players.append(readExactly(file, readExactly(file, 1)[0]).decode())
+                if ruleIndex == -1:
+                    rule, ruleName = None, readExactly(file, _short.unpack(readExactly(file, 2))[0]).decode()
+                else:
+                    rule = registry[ruleIndex]
+                    ruleName = rule.name
+                current = RoundReplay(rule, ruleName, players, handSize)
+                for hand in current.hands:
+                    for code in readExactly(file, _short.unpack(readExactly(file, 2))[0]):
+                        hand.addCard(Card.fromCode(code))
+                current.line.addToMain(Card.fromCode(readExactly(file, 1)[0]))
+            elif kind < len(outcomes) and current is not None:
+                player, code, count = _turnBody.unpack(readExactly(file, _turnBody.size))
+                outcome = outcomes[kind]
+                card = None if code == NO_CARD else Card.fromCode(code)
+                dealt = readExactly(file, count)
+                if onTurn:
+                    onTurn(current, outcome, player, card)
+                current.apply(outcome, player, card, dealt)
+                if outcome == Outcome.WIN:
+                    yield current
+            else:
+                raise ValueError(f"Unexpected record kind {kind} in the turn log")
+    if current is not None and current.winner is None:
+        yield current